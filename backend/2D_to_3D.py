@@ -5,6 +5,12 @@ import os
 import cv2  # Ensure OpenCV is installed
 import matplotlib.pyplot as plt  # For visualization
 import argparse
+import tempfile
+import math
+import mmap
+
+# Lanczos reads up to 3 source pixels (scaled by the downscale factor) past each output pixel
+LANCZOS_SUPPORT = 3.0
 
 def generate_height_map(image_path, alpha_threshold=10):
     """
@@ -152,7 +158,34 @@ def save_mesh(mesh, output_path):
     else:
         print(f"Failed to save mesh to {output_path}")
 
-def generate_3d_model(image_path, output_mesh_path, scale=(1.0, 1.0, 1.0), alpha_threshold=10, downscale_factor=1):
+def load_height_map(image_path, alpha_threshold=10, cache_dir=None):
+    """
+    Returns generate_height_map's result, reusing a copy persisted in cache_dir when it is
+    newer than the image. The height map only depends on the cutout and alpha_threshold, so
+    re-meshing with a different scale or downscale_factor never has to decode the image again.
+
+    :param image_path: Path to the input image with transparency.
+    :param alpha_threshold: Threshold to consider a pixel as opaque.
+    :param cache_dir: Directory for the persisted height maps (None disables caching).
+    :return: Tuple of (cropped height map, cropped RGB image).
+    """
+    if cache_dir is None:
+        return generate_height_map(image_path, alpha_threshold=alpha_threshold)
+
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    cache_path = os.path.join(cache_dir, f"{stem}_height_a{alpha_threshold}.npz")
+    if os.path.isfile(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(image_path):
+        with np.load(cache_path) as cached:
+            return cached["height_map"], cached["color_image"]
+
+    height_map, color_image = generate_height_map(image_path, alpha_threshold=alpha_threshold)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = cache_path + ".tmp.npz"
+    np.savez(tmp_path, height_map=height_map, color_image=color_image)
+    os.replace(tmp_path, cache_path)
+    return height_map, color_image
+
+def generate_3d_model(image_path, output_mesh_path, scale=(1.0, 1.0, 1.0), alpha_threshold=10, downscale_factor=1, cache_dir=None, max_triangles=None):
     """
     Complete pipeline to generate a 3D model from a 2D image.
 
@@ -161,9 +194,11 @@ def generate_3d_model(image_path, output_mesh_path, scale=(1.0, 1.0, 1.0), alpha
     :param scale: Tuple to scale the mesh in (x, y, z) directions.
     :param alpha_threshold: Threshold to consider a pixel as opaque.
     :param downscale_factor: Factor to downscale the image to reduce mesh complexity.
+    :param cache_dir: Directory to persist and reuse the height map in (see load_height_map).
+    :param max_triangles: Simplify the mesh to at most this many triangles (None keeps every triangle).
     """
     # Load and process the image
-    height_map, color_image = generate_height_map(image_path, alpha_threshold=alpha_threshold)
+    height_map, color_image = load_height_map(image_path, alpha_threshold=alpha_threshold, cache_dir=cache_dir)
 
     # Optional: Downscale the height map and color image
     if downscale_factor > 1:
@@ -209,7 +244,8 @@ def generate_3d_model(image_path, output_mesh_path, scale=(1.0, 1.0, 1.0), alpha
 
 
 
-    # mesh = simplify_mesh(mesh, 50000)
+    if max_triangles and len(mesh.triangles) > max_triangles:
+        mesh = simplify_mesh(mesh, max_triangles)
     # Save the mesh as GLB
     save_mesh(mesh, output_mesh_path)
 
@@ -232,6 +268,278 @@ def simplify_mesh(mesh, target_number_of_triangles):
     
     return simplified_mesh
 
+def release_pages(*arrays):
+    """
+    Flushes memory-mapped arrays and drops their pages from the resident set. The data stays
+    in the files, so the tiled functions call this after every band to keep peak memory
+    proportional to the band instead of the whole map.
+    """
+    for array in arrays:
+        if not isinstance(array, np.memmap):
+            continue
+        array.flush()
+        buffer = array
+        while isinstance(buffer, np.ndarray):
+            buffer = buffer.base
+        if isinstance(buffer, mmap.mmap) and hasattr(mmap, "MADV_DONTNEED"):
+            buffer.madvise(mmap.MADV_DONTNEED)
+
+def mask_bounding_box_tiled(image, alpha_threshold=10, tile_rows=256):
+    """
+    Bounding box of the cleaned mask of generate_height_map, computed band by band so that only
+    tile_rows rows of the mask exist at a time. The 3x3 closing (dilate, then erode) looks two
+    rows past each band edge, so every band is cleaned with two extra rows on each side.
+
+    :param image: Loaded RGBA image.
+    :return: Tuple of (x0, y0, x1, y1), exclusive at the top.
+    """
+    width, height = image.size
+    kernel = np.ones((3, 3), np.uint8)
+    rows_any = np.zeros(height, dtype=bool)
+    cols_any = np.zeros(width, dtype=bool)
+    for r0 in range(0, height, tile_rows):
+        r1 = min(r0 + tile_rows, height)
+        m0, m1 = max(r0 - 2, 0), min(r1 + 2, height)
+        alpha = np.asarray(image.crop((0, m0, width, m1)).getchannel('A'))
+        mask = cv2.morphologyEx((alpha > alpha_threshold).astype(np.uint8), cv2.MORPH_CLOSE, kernel)
+        mask = mask[r0 - m0:r1 - m0]
+        rows_any[r0:r1] = mask.any(axis=1)
+        cols_any |= mask.any(axis=0)
+
+    ys, xs = np.flatnonzero(rows_any), np.flatnonzero(cols_any)
+    if ys.size == 0:
+        raise ValueError("No opaque pixels found in the image.")
+    return int(xs[0]), int(ys[0]), int(xs[-1]) + 1, int(ys[-1]) + 1
+
+def read_flipped_band(image, box, size, o0, o1, resample_filter):
+    """
+    Returns rows o0..o1 of the image cropped to box, flipped vertically and resized to size, as
+    (alpha, RGB) uint8 arrays. Like generate_3d_model, alpha and RGB are resized as separate
+    images. Only the source rows that feed the band are read, plus a margin the width of the
+    filter's support, so the band sees the same neighbourhood as a full resize; values can still
+    differ from it by one step where Pillow's fixed-point rounding lands differently.
+
+    :param image: Loaded RGBA image.
+    :param box: Crop box (x0, y0, x1, y1) in the image.
+    :param size: Size (cols, rows) of the whole resized map.
+    """
+    x0, y0, x1, y1 = box
+    cols, rows = size
+    crop_w, crop_h = x1 - x0, y1 - y0
+    if (cols, rows) == (crop_w, crop_h):
+        band = np.asarray(image.crop((x0, y1 - o1, x1, y1 - o0)))[::-1]
+        return band[:, :, 3], band[:, :, :3]
+
+    # Rows top..bottom of the flipped crop
+    scale = crop_h / rows
+    margin = int(math.ceil(LANCZOS_SUPPORT * max(scale, 1.0))) + 1
+    top = max(int(o0 * scale) - margin, 0)
+    bottom = min(int(math.ceil(o1 * scale)) + margin, crop_h)
+    band = np.asarray(image.crop((x0, y1 - bottom, x1, y1 - top)))[::-1]
+
+    # Same float round trip generate_3d_model puts the alpha channel through
+    alpha = (band[:, :, 3].astype(np.float32) / 255.0 * 255).astype(np.uint8)
+    rgb = np.ascontiguousarray(band[:, :, :3])
+
+    band_box = (0, o0 * scale - top, crop_w, o1 * scale - top)
+    resized = [
+        np.asarray(Image.fromarray(channels).resize((cols, o1 - o0), resample=resample_filter, box=band_box))
+        for channels in (alpha, rgb)
+    ]
+    return resized[0], resized[1]
+
+def generate_height_map_tiled(image_path, work_dir, alpha_threshold=10, downscale_factor=1, tile_rows=256):
+    """
+    Tiled counterpart of generate_height_map: crops, flips and (optionally) downscales the image
+    like generate_3d_model does, then writes the height map and color image band by band into
+    memory-mapped .npy files.
+
+    Apart from the decoded image itself (4 bytes per pixel), every step works on bands of about
+    tile_rows rows: the mask and its bounding box, the crop and flip, and the resize.
+
+    :param image_path: Path to the input image with transparency.
+    :param work_dir: Directory for the memory-mapped arrays.
+    :param alpha_threshold: Threshold to consider a pixel as opaque.
+    :param downscale_factor: Factor to downscale the image to reduce mesh complexity.
+    :param tile_rows: Number of rows converted per band.
+    :return: Tuple of (memory-mapped height map, memory-mapped RGB image).
+    """
+    image = Image.open(image_path)
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+    image.load()
+
+    box = mask_bounding_box_tiled(image, alpha_threshold, tile_rows)
+    cols, rows = box[2] - box[0], box[3] - box[1]
+    if downscale_factor > 1:
+        cols, rows = cols // downscale_factor, rows // downscale_factor
+
+    try:
+        resample_filter = Image.Resampling.LANCZOS
+    except AttributeError:
+        resample_filter = Image.LANCZOS
+
+    height_map = np.lib.format.open_memmap(
+        os.path.join(work_dir, "height_map.npy"), mode='w+', dtype=np.float32, shape=(rows, cols)
+    )
+    color_image = np.lib.format.open_memmap(
+        os.path.join(work_dir, "color_image.npy"), mode='w+', dtype=np.uint8, shape=(rows, cols, 3)
+    )
+    for o0 in range(0, rows, tile_rows):
+        o1 = min(o0 + tile_rows, rows)
+        alpha, rgb = read_flipped_band(image, box, (cols, rows), o0, o1, resample_filter)
+        if downscale_factor > 1:
+            # generate_3d_model normalises the resized alpha in float64
+            height_map[o0:o1] = alpha / 255.0
+        else:
+            height_map[o0:o1] = alpha.astype(np.float32) / 255.0
+        color_image[o0:o1] = rgb
+        release_pages(height_map, color_image)
+    image.close()
+
+    return height_map, color_image
+
+def height_map_to_mesh_tiled(height_map, color_image, output_path, work_dir, scale=(1.0, 1.0, 1.0), tile_rows=256):
+    """
+    Tiled counterpart of height_map_to_mesh that writes the mesh straight to an OBJ file.
+
+    The height map is processed in bands of tile_rows rows. Each band owns the vertices of its
+    rows and reads one extra row from the next band to build the faces across the seam; vertex
+    indices are global (from a first counting pass), so the bands stitch together without
+    duplicated vertices. Vertices and faces are streamed into memory-mapped buffers and then
+    written out in chunks, so peak memory depends on tile_rows rather than the image size.
+
+    Unlike save_mesh, no vertex normals are written and unreferenced vertices are kept.
+
+    :param height_map: 2D array (may be memory-mapped) representing the height map.
+    :param color_image: 3D array (may be memory-mapped) representing the RGB color image.
+    :param output_path: Path to save the mesh (e.g., 'model.obj').
+    :param work_dir: Directory for the memory-mapped vertex and face buffers.
+    :param scale: Tuple to scale the mesh in (x, y, z) directions.
+    :param tile_rows: Number of rows processed per band.
+    """
+    rows, cols = height_map.shape
+    bands = [(r0, min(r0 + tile_rows, rows)) for r0 in range(0, rows, tile_rows)]
+
+    def band_valid(r0, r1):
+        # Vertices exist wherever the scaled height is non-zero, as in height_map_to_mesh
+        return height_map[r0:r1] * scale[2] != 0
+
+    # First pass: count vertices per row and faces per band to size the buffers
+    row_counts = np.zeros(rows, dtype=np.int64)
+    band_faces = []
+    for r0, r1 in bands:
+        # Faces of the band's rows need the first row of the next band
+        valid = band_valid(r0, min(r1 + 1, rows))
+        row_counts[r0:r1] = valid[:r1 - r0].sum(axis=1)
+        quads = valid[:-1, :-1] & valid[1:, :-1] & valid[:-1, 1:] & valid[1:, 1:]
+        band_faces.append(2 * int(quads.sum()))
+        release_pages(height_map)
+    row_offsets = np.concatenate(([0], np.cumsum(row_counts)))
+    num_vertices = int(row_offsets[-1])
+    num_faces = sum(band_faces)
+
+    if num_faces == 0:
+        raise ValueError("No triangles were created. Check if the height map has sufficient non-zero heights.")
+
+    # Per vertex: x, y, z, r, g, b, u, v
+    vertices = np.memmap(os.path.join(work_dir, "vertices.dat"), mode='w+', dtype=np.float32,
+                         shape=(num_vertices, 8))
+    faces = np.memmap(os.path.join(work_dir, "faces.dat"), mode='w+', dtype=np.int64,
+                      shape=(num_faces, 3))
+
+    # Second pass: fill the buffers band by band
+    face_offset = 0
+    for (r0, r1), count in zip(bands, band_faces):
+        valid = band_valid(r0, min(r1 + 1, rows))
+
+        own = valid[:r1 - r0]
+        ii, jj = np.nonzero(own)
+        ii_global = ii + r0
+        start, end = row_offsets[r0], row_offsets[r1]
+        vertices[start:end, 0] = jj * scale[0]
+        vertices[start:end, 1] = ii_global * scale[1]
+        vertices[start:end, 2] = height_map[r0:r1][own] * scale[2]
+        vertices[start:end, 3:6] = color_image[r0:r1][own] / 255.0
+        vertices[start:end, 6] = jj / (cols - 1)
+        vertices[start:end, 7] = ii_global / (rows - 1)
+
+        if count:
+            # Global vertex index of every valid pixel in the band (plus the seam row)
+            index = np.full(valid.shape, -1, dtype=np.int64)
+            index[valid] = np.arange(row_offsets[r0], row_offsets[r0] + valid.sum())
+            quads = valid[:-1, :-1] & valid[1:, :-1] & valid[:-1, 1:] & valid[1:, 1:]
+            idx = index[:-1, :-1][quads]
+            idx_down = index[1:, :-1][quads]
+            idx_right = index[:-1, 1:][quads]
+            idx_diag = index[1:, 1:][quads]
+            # Same two triangles per grid cell as height_map_to_mesh
+            band_triangles = np.stack([
+                np.stack([idx, idx_down, idx_diag], axis=1),
+                np.stack([idx, idx_diag, idx_right], axis=1),
+            ], axis=1).reshape(-1, 3)
+            faces[face_offset:face_offset + count] = band_triangles
+            face_offset += count
+        release_pages(vertices, faces, height_map, color_image)
+
+    write_obj_streaming(vertices, faces, output_path, chunk_rows=max(tile_rows * cols, 1))
+
+def write_obj_streaming(vertices, faces, output_path, chunk_rows=65536):
+    """
+    Writes vertex and face buffers to an OBJ/MTL pair in chunks, in the same layout Open3D uses
+    (vertex colors on 'v' lines, one material).
+
+    :param vertices: (N, 8) array of x, y, z, r, g, b, u, v.
+    :param faces: (M, 3) array of zero-based vertex indices.
+    :param output_path: Path to save the mesh (e.g., 'model.obj').
+    :param chunk_rows: Number of vertices or faces formatted at a time.
+    """
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    object_name = os.path.splitext(os.path.basename(output_path))[0]
+    mtl_path = os.path.splitext(output_path)[0] + ".mtl"
+
+    with open(mtl_path, "w") as f:
+        f.write(f"# Created by 2D_to_3D.py\n# object name: {object_name}\n")
+        f.write(f"newmtl {object_name}_0\nKa 1.000 1.000 1.000\nKd 1.000 1.000 1.000\nKs 0.000 0.000 0.000\n")
+
+    with open(output_path, "w") as f:
+        f.write(f"# Created by 2D_to_3D.py\n# object name: {object_name}\n")
+        f.write(f"# number of vertices: {len(vertices)}\n# number of triangles: {len(faces)}\n")
+        f.write(f"mtllib {os.path.basename(mtl_path)}\n")
+        for start in range(0, len(vertices), chunk_rows):
+            np.savetxt(f, vertices[start:start + chunk_rows, :6], fmt="v %g %g %g %g %g %g")
+            release_pages(vertices)
+        for start in range(0, len(vertices), chunk_rows):
+            np.savetxt(f, vertices[start:start + chunk_rows, 6:], fmt="vt %g %g")
+            release_pages(vertices)
+        f.write(f"usemtl {object_name}_0\n")
+        for start in range(0, len(faces), chunk_rows):
+            # OBJ indices are one-based; the texture index equals the vertex index
+            chunk = np.repeat(faces[start:start + chunk_rows] + 1, 2, axis=1)
+            np.savetxt(f, chunk, fmt="f %d/%d %d/%d %d/%d")
+            release_pages(faces)
+
+    print(f"Mesh successfully saved to {output_path}")
+
+def generate_3d_model_tiled(image_path, output_mesh_path, scale=(1.0, 1.0, 1.0), alpha_threshold=10, downscale_factor=1, tile_rows=256):
+    """
+    Same as generate_3d_model, but meshes the height map in bands of tile_rows rows using
+    memory-mapped buffers. Use this for cutouts that are too large to mesh in memory.
+    Only reachable through the --tile_rows command-line option: the pipeline's cutouts are
+    capped at 1024px by run.py and need the height map cache that remesh.py reads.
+
+    :param tile_rows: Number of rows processed per band.
+    """
+    with tempfile.TemporaryDirectory(prefix="mesh_tiles_") as work_dir:
+        height_map, color_image = generate_height_map_tiled(
+            image_path, work_dir, alpha_threshold=alpha_threshold,
+            downscale_factor=downscale_factor, tile_rows=tile_rows
+        )
+        height_map_to_mesh_tiled(height_map, color_image, output_mesh_path, work_dir,
+                                 scale=scale, tile_rows=tile_rows)
+        # Drop the memory maps before the directory is removed
+        del height_map, color_image
+
 # Main execution
 if __name__ == "__main__":
     # Argument parsing
@@ -242,20 +550,41 @@ if __name__ == "__main__":
                         help='Scale factors for x, y, z axes (default: 1.0 1.0 1.0)')
     parser.add_argument('--alpha_threshold', type=int, default=10,
                         help='Alpha threshold for transparency (default: 10)')
-    parser.add_argument('--downscale_factor', type=int, default=1,
-                        help='Factor to downscale the image for mesh generation (default: 1)')
+    parser.add_argument('--downscale_factor', type=int, default=4,
+                        help='Factor to downscale the image for mesh generation (default: 4)')
+    parser.add_argument('--tile_rows', type=int, default=0,
+                        help='Mesh in bands of this many rows to bound memory use (default: 0, untiled)')
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help='Directory to persist the height map in for later re-meshing (untiled only)')
+    parser.add_argument('--max_triangles', type=int, default=0,
+                        help='Simplify the mesh to at most this many triangles (default: 0, no limit; untiled only)')
 
     args = parser.parse_args()
+    # The tiled mode neither persists the height map nor simplifies the mesh
+    if args.tile_rows > 0 and (args.cache_dir or args.max_triangles):
+        parser.error("--tile_rows cannot be combined with --cache_dir or --max_triangles")
 
     # Validate output file extension
     if not args.output_mesh_path.lower().endswith('.obj'):
         raise ValueError("Output mesh path must have a '.obj' extension.")
 
     # Call the function to generate 3D model
-    generate_3d_model(
-        image_path=args.image_path,
-        output_mesh_path=args.output_mesh_path,
-        scale=tuple(args.scale),
-        alpha_threshold=args.alpha_threshold,
-        downscale_factor=4  # Downscale the image by a factor of 4 for faster processing
-    )
+    if args.tile_rows > 0:
+        generate_3d_model_tiled(
+            image_path=args.image_path,
+            output_mesh_path=args.output_mesh_path,
+            scale=tuple(args.scale),
+            alpha_threshold=args.alpha_threshold,
+            downscale_factor=args.downscale_factor,
+            tile_rows=args.tile_rows
+        )
+    else:
+        generate_3d_model(
+            image_path=args.image_path,
+            output_mesh_path=args.output_mesh_path,
+            scale=tuple(args.scale),
+            alpha_threshold=args.alpha_threshold,
+            downscale_factor=args.downscale_factor,
+            cache_dir=args.cache_dir,
+            max_triangles=args.max_triangles or None
+        )
@@ -9,17 +9,26 @@ from oauth_handler import get_valid_link
 import logging
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-from mongodb_handler import save_clothes, get_all_clothes  # Import the save_clothes and get_clothes functions
+from mongodb_handler import save_clothes, update_clothes, get_all_clothes, get_clothes_by_filenames  # Import the save_clothes and get_clothes functions
+from pipeline import UPLOAD_FOLDER, OUTPUT_FOLDER, THREED_FOLDER, STAGES, new_job, embedding_index
+from stage_executor import StagePipeline, StageError
+from thumbnails import get_thumbnail
+from colors import COLOR_BINS
+from remesh import DEFAULT_DOWNSCALE_FACTOR, create_pool, list_items, remesh_items, try_remesh_lock
+from artifacts import SENDFILE_MODE, artifact_url, content_hash, split_hashed_filename, send_artifact
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 import os
-import subprocess
+import threading
 from werkzeug.utils import secure_filename
 import traceback  # Add this import for detailed error reporting
 from flask_cors import CORS  # Import CORS
-from flask import send_from_directory
+from flask import redirect
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+from concurrent.futures.process import BrokenProcessPool
 
 app = Flask(__name__)
 
@@ -35,24 +44,113 @@ HARDCODED_PASSWORD = "securepassword123"  # Replace with a secure password
 
 CORS(app)
 
-UPLOAD_FOLDER = './uploads'
-OUTPUT_FOLDER = './output'
-THREED_FOLDER = './3Doutput'
+# Folders served through the artifact layer, by their public name
+ARTIFACT_FOLDERS = {"output": OUTPUT_FOLDER, "3Doutput": THREED_FOLDER}
+
+# Let Apache/lighttpd send file bytes when ARTIFACT_SENDFILE=x-sendfile
+app.config["USE_X_SENDFILE"] = SENDFILE_MODE == "x-sendfile"
+
+# Worker threads per pipeline stage, e.g. PIPELINE_MESHING_WORKERS=4
+DEFAULT_STAGE_WORKERS = {"decode": 1, "dedup": 1, "segmentation": 1, "postprocess": 2, "embedding": 1, "meshing": 2, "encode": 1}
+
+# Segmentation, cutout and meshing for all uploads run through one shared stage pipeline,
+# so meshing of one upload overlaps with segmentation of the next
+upload_pipeline = StagePipeline(
+    [
+        (name, func, int(os.getenv(f"PIPELINE_{name.upper()}_WORKERS", DEFAULT_STAGE_WORKERS[name])))
+        for name, func in STAGES
+    ],
+    queue_size=int(os.getenv("PIPELINE_QUEUE_SIZE", 4)),
+)
+
+# Load shedding for /uploadClothes. An upload holds a request thread until the pipeline is done,
+# so uploads may only use UPLOAD_SLOTS of each process's threads; the rest stay free for
+# /getClothes, /login and the file endpoints.
+GUNICORN_THREADS = int(os.getenv("GUNICORN_THREADS", 8))
+READ_RESERVED_THREADS = int(os.getenv("READ_RESERVED_THREADS", 2))
+UPLOAD_SLOTS = max(1, GUNICORN_THREADS - READ_RESERVED_THREADS)
+# Pending pipeline jobs from which new uploads use the cheaper "degraded" profile...
+DEGRADE_QUEUE_DEPTH = int(os.getenv("DEGRADE_QUEUE_DEPTH", 2))
+# ...and from which they are rejected with 503
+SHED_QUEUE_DEPTH = int(os.getenv("SHED_QUEUE_DEPTH", UPLOAD_SLOTS))
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", 30))
+
+upload_slots = threading.BoundedSemaphore(UPLOAD_SLOTS)
+load_counters = {"accepted": 0, "degraded": 0, "shed": 0}
+load_counters_lock = threading.Lock()
+
+
+# One pool shared by all /remesh requests of this process
+REMESH_WORKERS = int(os.getenv("REMESH_WORKERS", 2))
+remesh_pool = create_pool(REMESH_WORKERS)
+
+
+def count_upload(outcome):
+    with load_counters_lock:
+        load_counters[outcome] += 1
+
+
+def busy_response():
+    response = jsonify({"error": "Server is busy, please retry later"})
+    response.headers["Retry-After"] = str(RETRY_AFTER_SECONDS)
+    return response, 503
 
 @app.route('/getClothes', methods=['GET'])
 def get_clothes():
     try:
+        # Optional ?color=<bin> filter on the colors extracted from the photo
+        color = request.args.get('color', '').strip().lower() or None
+        if color and color not in COLOR_BINS:
+            return jsonify({"error": f"Unknown color, expected one of: {', '.join(COLOR_BINS)}"}), 400
+
         # Fetch all clothes from MongoDB
-        clothes = get_all_clothes()  # Assuming `get_all_clothes()` is defined in mongodb_handler.py
+        clothes = get_all_clothes(color)  # Assuming `get_all_clothes()` is defined in mongodb_handler.py
         return jsonify({"clothes": clothes}), 200
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
     
 
+@app.route('/similar/<id>', methods=['GET'])
+def get_similar_clothes(id):
+    """
+    Returns the clothes that look most like the given one (by photo_filename), most similar first.
+    Pass ?k=<n> to change the number of results (default 10).
+    """
+    try:
+        k = max(1, min(request.args.get('k', 10, type=int), 100))
+        vector = embedding_index.get(id)
+        if vector is None:
+            return jsonify({"error": "No embedding found for this item"}), 404
+
+        matches = embedding_index.search(vector, k=k, exclude=id)
+        scores = dict(matches)
+        clothes = get_clothes_by_filenames([name for name, _ in matches])
+        for item in clothes:
+            item["similarity"] = scores[item["photo_filename"]]
+        return jsonify({"clothes": clothes}), 200
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+
 @app.route('/uploadClothes', methods=['POST'])
 def upload_clothes():
     logger.info("Received request to upload clothes")
+
+    # Shed load before reading the upload or touching MongoDB
+    if upload_pipeline.pending() >= SHED_QUEUE_DEPTH or not upload_slots.acquire(blocking=False):
+        count_upload("shed")
+        logger.warning("Upload pipeline is overloaded, rejecting upload")
+        return busy_response()
+
+    try:
+        return handle_upload()
+    finally:
+        upload_slots.release()
+
+
+def handle_upload():
     try:
         # Ensure there is a photo file in the request
         if 'photo' not in request.files:
@@ -85,53 +183,123 @@ def upload_clothes():
         photo.save(local_image_path)
 
         # Save the clothes data to MongoDB, including the file name
-        save_clothes(type, size, color, filename)
+        clothes_id = save_clothes(type, size, color, filename)
 
-        # ---- Run the first script (run_and_process.py) ----
+        # ---- Run segmentation, cutout and meshing through the stage pipeline ----
+        # With a deep queue, trade model quality for throughput
+        profile = "degraded" if upload_pipeline.pending() >= DEGRADE_QUEUE_DEPTH else "full"
+        count_upload("degraded" if profile == "degraded" else "accepted")
         try:
-            run_command = ["python", "./run_and_process.py", local_image_path]
-            subprocess.run(run_command, check=True)
-            print("run_and_process.py completed successfully.")
-        except subprocess.CalledProcessError as e:
-            print(f"run_and_process.py failed: {e}")
-            return jsonify({"error": f"run_and_process.py failed: {e}"}), 500
+            job = upload_pipeline.submit(new_job(local_image_path, profile)).result()
+            output_obj_path = job["3D_model"]
+            update_clothes(clothes_id, job["fields"])
+            print("Upload pipeline completed successfully.")
+        except StageError as e:
+            print(f"Upload pipeline failed: {e}")
+            return jsonify({"error": str(e)}), 500
 
-        # ---- Run the second script (2D_to_3D.py) on the processed result ----
-        processed_image_path = os.path.join(OUTPUT_FOLDER, f"{os.path.splitext(filename)[0]}_final.png")
+        return jsonify({"message": "Clothes uploaded and 3D model generated successfully!", "3D_model": output_obj_path, "color_bins": job["colors"]["color_bins"], "duplicate_of": job.get("duplicate_of"), "profile": profile}), 201
 
+    except Exception as e:
+        logger.error(f"Error uploading clothes: {e}")
+        traceback.print_exc()
+        return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
 
-        if not os.path.exists(processed_image_path):
-            return jsonify({"error": "Processed image not found"}), 500
+
+@app.route('/remesh', methods=['POST'])
+def remesh():
+    """
+    Rebuilds meshes from the persisted cutouts and height maps with new mesh parameters.
+    Body: {"names": [...]} or {"all": true}, plus optional scale, alpha_threshold and downscale_factor.
+    The work runs in the background on a shared process pool; the response lists the items that
+    were queued. Only one remesh runs at a time (409 otherwise), and none start while uploads
+    are queueing (503).
+    """
+    logger.info("Received remesh request")
+    try:
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({"error": "Body must be a JSON object"}), 400
+        if data.get("all"):
+            names = list_items()
+        else:
+            names = data.get("names")
+            if not isinstance(names, list) or not all(
+                isinstance(name, str) and name and secure_filename(name) == name for name in names
+            ):
+                return jsonify({"error": "names must be a list of item names"}), 400
+        if not names:
+            return jsonify({"error": "Missing names or all"}), 400
 
         try:
-            output_obj_path = os.path.join(THREED_FOLDER, f"{os.path.splitext(filename)[0]}.obj")
-            threeD_command = [
-                "python", "./2D_to_3D.py", 
-                processed_image_path, 
-                output_obj_path
-            ]
-            subprocess.run(threeD_command, check=True)
-            print("2D_to_3D.py completed successfully.")
-        except subprocess.CalledProcessError as e:
-            print(f"2D_to_3D.py failed: {e}")
-            return jsonify({"error": f"2D_to_3D.py failed: {e}"}), 500
-
-        return jsonify({"message": "Clothes uploaded and 3D model generated successfully!", "3D_model": output_obj_path}), 201
+            mesh_args = {
+                "scale": tuple(float(value) for value in data.get("scale", (1.0, 1.0, 1.0))),
+                "alpha_threshold": int(data.get("alpha_threshold", 10)),
+                "downscale_factor": int(data.get("downscale_factor", DEFAULT_DOWNSCALE_FACTOR)),
+            }
+        except (TypeError, ValueError):
+            return jsonify({"error": "Invalid mesh parameters"}), 400
+        if len(mesh_args["scale"]) != 3 or mesh_args["downscale_factor"] < 1:
+            return jsonify({"error": "Invalid mesh parameters"}), 400
+
+        # Re-meshing can wait; leave the CPU to uploads while they are queueing
+        if upload_pipeline.pending() >= DEGRADE_QUEUE_DEPTH:
+            return busy_response()
+        lock_file = try_remesh_lock()
+        if lock_file is None:
+            return jsonify({"error": "A remesh is already running"}), 409
+
+        def run():
+            global remesh_pool
+            try:
+                remesh_items(names, executor=remesh_pool, **mesh_args)
+            except BrokenProcessPool:
+                logger.error("A remesh worker died; replacing the pool")
+                remesh_pool = create_pool(REMESH_WORKERS)
+            finally:
+                lock_file.close()
+
+        threading.Thread(target=run, daemon=True).start()
+        return jsonify({"message": "Re-meshing started", "names": names}), 202
 
     except Exception as e:
-        logger.error(f"Error uploading clothes: {e}")
+        logger.error(f"Error starting remesh: {e}")
         traceback.print_exc()
         return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
 
 
+@app.route('/pipelineStats', methods=['GET'])
+def pipeline_stats():
+    stats = upload_pipeline.stats()
+    with load_counters_lock:
+        stats["uploads"] = dict(load_counters)
+    stats["limits"] = {
+        "upload_slots": UPLOAD_SLOTS,
+        "degrade_queue_depth": DEGRADE_QUEUE_DEPTH,
+        "shed_queue_depth": SHED_QUEUE_DEPTH,
+    }
+    return jsonify(stats), 200
+
+
 # Serve files from OUTPUT_FOLDER
+# Pass ?size=<width> to get the nearest WebP/AVIF thumbnail instead of the full cutout
 @app.route('/output/<path:filename>', methods=['GET'])
 def serve_output_file(filename):
     try:
         filepath = filename + "_final.png"
-        print(f"Requested file: {filepath}")
-        print(f"File path: {os.path.join(OUTPUT_FOLDER, filepath )}")
-        return send_from_directory(OUTPUT_FOLDER, filepath)
+        size = request.args.get('size', type=int)
+        if size:
+            thumbnail = get_thumbnail(os.path.join(OUTPUT_FOLDER, filepath), filename, size, request.accept_mimetypes)
+            if thumbnail:
+                path, mimetype = thumbnail
+                # Variants live under the output folder; the URL is reused when a re-upload
+                # regenerates them, so they are revalidated against the content-hash ETag
+                response = send_artifact("output", OUTPUT_FOLDER, os.path.relpath(path, OUTPUT_FOLDER), mimetype=mimetype)
+                response.vary.add('Accept')
+                return response
+        return send_artifact("output", OUTPUT_FOLDER, filepath)
+    except (FileNotFoundError, NotFound):
+        return jsonify({"error": "File not found"}), 404
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": f"Error serving file: {str(e)}"}), 500
@@ -140,10 +308,49 @@ def serve_output_file(filename):
 @app.route('/3Doutput/<path:filename>', methods=['GET'])
 def serve_threed_file(filename):
     try:
-        return send_from_directory(THREED_FOLDER, filename + ".obj")
+        return send_artifact("3Doutput", THREED_FOLDER, filename + ".obj")
+    except NotFound:
+        return jsonify({"error": "File not found"}), 404
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": f"Error serving file: {str(e)}"}), 500
+
+
+# Immutable, content-hashed artefact URLs, e.g. /artifacts/3Doutput/P0_5.3f2a9c0d1e4b5a67.obj
+# A stale hash redirects to the current version of the file
+@app.route('/artifacts/<folder_name>/<path:hashed_name>', methods=['GET'])
+def serve_artifact(folder_name, hashed_name):
+    try:
+        folder = ARTIFACT_FOLDERS.get(folder_name)
+        if folder is None:
+            return jsonify({"error": "Unknown artifact folder"}), 404
+        filename, digest = split_hashed_filename(hashed_name)
+        path = safe_join(folder, filename)
+        if path is None or not os.path.isfile(path):
+            return jsonify({"error": "File not found"}), 404
+        if digest != content_hash(path):
+            return redirect(artifact_url(folder_name, folder, filename))
+        return send_artifact(folder_name, folder, filename, immutable=True)
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": f"Error serving file: {str(e)}"}), 500
+
+
+# Hashed URLs of a garment's cutout and model, for clients that want cache-forever links
+@app.route('/artifactUrls/<name>', methods=['GET'])
+def get_artifact_urls(name):
+    urls = {}
+    for key, folder_name, filename in (
+        ("image", "output", f"{name}_final.png"),
+        ("model", "3Doutput", f"{name}.obj"),
+        ("material", "3Doutput", f"{name}.mtl"),
+    ):
+        path = safe_join(ARTIFACT_FOLDERS[folder_name], filename)
+        if path and os.path.isfile(path):
+            urls[key] = artifact_url(folder_name, ARTIFACT_FOLDERS[folder_name], filename)
+    if not urls:
+        return jsonify({"error": "File not found"}), 404
+    return jsonify(urls), 200
     
     
 @app.route('/login', methods=['POST'])
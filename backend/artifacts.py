@@ -0,0 +1,186 @@
+# artifacts.py
+import os
+import gzip
+import hashlib
+import tempfile
+import mimetypes
+import threading
+from flask import current_app, request, send_file
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+try:
+    import brotli  # Optional: enables .br variants
+except ImportError:
+    brotli = None
+
+# Files that get precompressed .gz/.br variants
+COMPRESSIBLE_EXTENSIONS = ('.obj', '.mtl')
+
+# Hand-off mode for a front proxy: "x-accel" (nginx X-Accel-Redirect), "x-sendfile" (Apache/lighttpd)
+# or empty to let Flask send the bytes itself
+SENDFILE_MODE = os.getenv("ARTIFACT_SENDFILE", "").lower()
+# Internal nginx location the folders are exposed under, e.g. "location /protected/ { internal; alias ...; }"
+ACCEL_PREFIX = os.getenv("ARTIFACT_ACCEL_PREFIX", "/protected").rstrip("/")
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+mimetypes.add_type("text/plain", ".obj")
+mimetypes.add_type("text/plain", ".mtl")
+
+_hash_cache = {}
+_hash_lock = threading.Lock()
+
+
+def content_hash(path):
+    """
+    Returns a short SHA-256 digest of a file. Digests are cached until the file's size or mtime changes.
+    """
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _hash_lock:
+        cached = _hash_cache.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    value = digest.hexdigest()[:16]
+
+    with _hash_lock:
+        _hash_cache[path] = (key, value)
+    return value
+
+
+def hashed_filename(path):
+    """
+    Returns the immutable name of a file, e.g. 'P0_5.obj' -> 'P0_5.3f2a9c0d1e4b5a67.obj'.
+    """
+    stem, ext = os.path.splitext(os.path.basename(path))
+    return f"{stem}.{content_hash(path)}{ext}"
+
+
+def artifact_url(folder_name, folder, filename):
+    """
+    Returns the immutable URL of a file in one of the artefact folders.
+    """
+    return f"/artifacts/{folder_name}/{hashed_filename(os.path.join(folder, filename))}"
+
+
+def split_hashed_filename(hashed_name):
+    """
+    Splits 'P0_5.3f2a9c0d1e4b5a67.obj' into ('P0_5.obj', '3f2a9c0d1e4b5a67').
+    Returns (hashed_name, None) if the name carries no hash.
+    """
+    stem, ext = os.path.splitext(hashed_name)
+    base, dot, digest = stem.rpartition(".")
+    if not dot or len(digest) != 16:
+        return hashed_name, None
+    return base + ext, digest
+
+
+def _is_fresh(variant_path, path):
+    try:
+        return os.path.getmtime(variant_path) >= os.path.getmtime(path)
+    except OSError:
+        return False
+
+
+def precompress(path):
+    """
+    Writes .gz (and .br when brotli is installed) variants next to a file.
+
+    :return: List of the variant paths.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    variants = [(path + ".gz", lambda: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append((path + ".br", lambda: brotli.compress(data, quality=11)))
+
+    paths = []
+    for variant_path, compress in variants:
+        # A unique temporary name per writer; if two processes compress the same file,
+        # whichever replace lands last wins and both variants are identical anyway
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(variant_path) or ".",
+                                        prefix=os.path.basename(variant_path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(compress())
+            os.replace(tmp_path, variant_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        paths.append(variant_path)
+    return paths
+
+
+def _pick_encoding(path):
+    """
+    Chooses a precompressed variant the client accepts. Range requests always get the
+    identity encoding so byte offsets refer to the original file.
+
+    Variants are written by the pipeline's encode stage and by remesh.py, never on the request
+    path; a missing or stale variant is skipped in favour of the identity bytes.
+    """
+    if not path.lower().endswith(COMPRESSIBLE_EXTENSIONS) or "Range" in request.headers:
+        return None, path
+    for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+        if encoding == "br" and brotli is None:
+            continue
+        if request.accept_encodings.quality(encoding) <= 0:
+            continue
+        variant_path = path + suffix
+        if _is_fresh(variant_path, path):
+            return encoding, variant_path
+    return None, path
+
+
+def send_artifact(folder_name, folder, filename, immutable=False, mimetype=None):
+    """
+    Sends a file from one of the artefact folders with a strong content-hash ETag
+    (so If-None-Match and Range are handled by send_file), a precompressed variant when
+    the client accepts one, and an X-Accel-Redirect/X-Sendfile hand-off when configured.
+
+    :param folder_name: Public name of the folder (used for the X-Accel-Redirect location).
+    :param folder: Directory on disk.
+    :param filename: File inside the folder.
+    :param immutable: True when the URL carries the content hash and can be cached forever.
+    :param mimetype: MIME type to send, when it cannot be guessed from the extension.
+    """
+    path = safe_join(folder, filename)
+    if path is None or not os.path.isfile(path):
+        raise NotFound()
+
+    etag = content_hash(path)
+    encoding, send_path = _pick_encoding(path)
+    if encoding:
+        etag = f"{etag}-{encoding}"
+    mimetype = mimetype or mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    if SENDFILE_MODE == "x-accel":
+        # nginx serves the bytes (and handles Range) from the internal location;
+        # revalidation is answered here so unchanged files never reach nginx
+        if etag in request.if_none_match:
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.response_class(mimetype=mimetype)
+            response.headers["X-Accel-Redirect"] = (
+                f"{ACCEL_PREFIX}/{folder_name}/{os.path.relpath(send_path, folder)}"
+            )
+        response.set_etag(etag)
+    else:
+        # With app.config["USE_X_SENDFILE"] set, send_file only emits the X-Sendfile header
+        response = send_file(os.path.abspath(send_path), mimetype=mimetype, etag=etag, conditional=True)
+
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    if path.lower().endswith(COMPRESSIBLE_EXTENSIONS):
+        response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+    return response
@@ -0,0 +1,80 @@
+import os
+import sys
+import argparse
+import traceback
+
+from pipeline import OUTPUT_FOLDER, embedding_index
+from colors import extract_dominant_colors
+from embeddings import compute_embedding
+from mongodb_handler import backfill_clothes, find_filenames_missing
+from remesh import list_items
+
+# Documents updated per bulk_write, so an interrupted run keeps most of its work
+CHUNK_SIZE = 200
+
+
+def backfill_colors():
+    """
+    Extracts the dominant colors of every catalogue item saved before color extraction existed,
+    from its '<name>_final.png' cutout, so that /getClothes?color= finds it.
+
+    :return: Number of items that could not be backfilled.
+    """
+    names = find_filenames_missing("color_bins")
+    print(f"{len(names)} items without color_bins.")
+    failures = 0
+    updates = {}
+    for i, name in enumerate(names, start=1):
+        cutout_path = os.path.join(OUTPUT_FOLDER, f"{name}_final.png")
+        try:
+            updates[name] = extract_dominant_colors(cutout_path)
+        except Exception as e:
+            failures += 1
+            print(f"Failed to extract the colors of {name}: {e}")
+            traceback.print_exc()
+        if len(updates) >= CHUNK_SIZE or i == len(names):
+            backfill_clothes("color_bins", updates)
+            print(f"Backfilled colors ({i}/{len(names)})")
+            updates = {}
+    return failures
+
+
+def backfill_embeddings():
+    """
+    Adds the CLIP embedding of every cutout that is not in the similarity index yet,
+    so that /similar/<id> works for items processed before the index existed.
+
+    :return: Number of items that could not be backfilled.
+    """
+    names = [name for name in list_items() if embedding_index.get(name) is None]
+    print(f"{len(names)} items without an embedding.")
+    failures = 0
+    for i, name in enumerate(names, start=1):
+        try:
+            embedding_index.add(name, compute_embedding(os.path.join(OUTPUT_FOLDER, f"{name}_final.png")))
+            print(f"Backfilled embedding of {name} ({i}/{len(names)})")
+        except Exception as e:
+            failures += 1
+            print(f"Failed to embed {name}: {e}")
+            traceback.print_exc()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fill in the fields of catalogue items processed before the pipeline computed them.')
+    parser.add_argument('fields', nargs='+', choices=['colors', 'embeddings'], help='What to backfill')
+
+    args = parser.parse_args()
+
+    failures = 0
+    if 'colors' in args.fields:
+        failures += backfill_colors()
+    if 'embeddings' in args.fields:
+        failures += backfill_embeddings()
+    if failures:
+        print(f"{failures} items failed; rerun the same command to retry them.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
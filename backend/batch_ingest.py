@@ -0,0 +1,216 @@
+import os
+import sys
+import csv
+import json
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from werkzeug.utils import secure_filename
+
+from pipeline import UPLOAD_FOLDER, stage_upload, process_item
+from mongodb_handler import save_clothes_many
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+
+def read_manifest(manifest_path):
+    """
+    Reads a CSV manifest with the columns path, type, size and color.
+    Relative paths are resolved against the manifest's directory.
+    """
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    items = []
+    with open(manifest_path, newline='') as f:
+        reader = csv.DictReader(f)
+        missing = {"path", "type", "size", "color"} - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f"Manifest is missing columns: {', '.join(sorted(missing))}")
+        for row in reader:
+            path = row["path"].strip()
+            if not os.path.isabs(path):
+                path = os.path.join(manifest_dir, path)
+            items.append({
+                "path": path,
+                "type": row["type"].strip(),
+                "size": row["size"].strip(),
+                "color": row["color"].strip(),
+            })
+    return items
+
+
+def read_directory(directory, type, size, color):
+    """
+    Lists every image in a directory, giving all of them the same type, size and color.
+    """
+    items = []
+    for entry in sorted(os.listdir(directory)):
+        if entry.lower().endswith(IMAGE_EXTENSIONS):
+            items.append({
+                "path": os.path.join(directory, entry),
+                "type": type,
+                "size": size,
+                "color": color,
+            })
+    return items
+
+
+def item_name(item):
+    """
+    Name the item is stored under, derived from its file name the same way /uploadClothes does
+    (e.g. 'photos/Blue Shirt (1).jpg' -> 'Blue_Shirt_1').
+    """
+    return os.path.splitext(secure_filename(os.path.basename(item["path"])))[0]
+
+
+def load_checkpoint(checkpoint_path):
+    """
+    Loads the checkpoint file. 'completed' maps an item name to its Mongo record, 'inserted'
+    lists the names whose records are already in the database and 'claimed' lists the names
+    this batch has copied (or is about to copy) into the uploads folder.
+    """
+    if not os.path.isfile(checkpoint_path):
+        return {"completed": {}, "inserted": [], "claimed": []}
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+    checkpoint.setdefault("completed", {})
+    checkpoint.setdefault("inserted", [])
+    checkpoint.setdefault("claimed", list(checkpoint["completed"]))
+    return checkpoint
+
+
+def save_checkpoint(checkpoint, checkpoint_path):
+    # Write to a temporary file first so an interrupt never leaves a truncated checkpoint
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def find_conflicts(items, checkpoint):
+    """
+    Finds items that would overwrite another upload, since items are stored under their
+    sanitised name (see item_name): several items with the same name (e.g. 'a/shirt.jpg' and
+    'b/shirt.png', or 'blue shirt.jpg' and 'blue_shirt.jpg'), an item whose name is already
+    taken in the uploads folder by an image this batch did not store, or a file name with
+    nothing left after sanitising.
+
+    :return: List of messages, one per conflicting name.
+    """
+    ours = set(checkpoint["completed"]) | set(checkpoint["claimed"])
+    paths_by_name = {}
+    for item in items:
+        paths_by_name.setdefault(item_name(item), []).append(item["path"])
+
+    conflicts = []
+    for name, paths in paths_by_name.items():
+        if not name:
+            conflicts.append(f"{', '.join(paths)}: no usable file name")
+        elif len(paths) > 1:
+            conflicts.append(f"{name}: used by {', '.join(paths)}")
+        elif name not in ours and os.path.exists(os.path.join(UPLOAD_FOLDER, name)):
+            conflicts.append(f"{name}: already exists in {UPLOAD_FOLDER}")
+    return conflicts
+
+
+def ingest_item(item):
+    """
+    Worker entry point: stores the image in the uploads folder and runs the pipeline on it.
+    """
+    local_image_path = stage_upload(item["path"], item_name(item))
+    result = process_item(local_image_path)
+    return {
+        "type": item["type"],
+        "size": item["size"],
+        "color": item["color"],
+        "photo_filename": result["name"],
+        **result["fields"],
+    }
+
+
+def run_batch(items, checkpoint_path, workers=None):
+    """
+    Runs the pipeline for every item that is not already in the checkpoint, then saves all
+    new records to MongoDB with a single insert_many.
+
+    :return: Number of items that failed.
+    :raises ValueError: If items would overwrite each other or existing uploads (nothing is processed).
+    """
+    checkpoint = load_checkpoint(checkpoint_path)
+    completed = checkpoint["completed"]
+
+    conflicts = find_conflicts(items, checkpoint)
+    if conflicts:
+        raise ValueError("Items would overwrite other uploads; rename them and retry:\n  " + "\n  ".join(conflicts))
+
+    pending = [item for item in items if item_name(item) not in completed]
+    print(f"{len(items)} items in batch, {len(items) - len(pending)} already done, {len(pending)} to process.")
+
+    failures = 0
+    if pending:
+        # Claim the names before storing anything, so a rerun after a crash can reuse them
+        claimed = set(checkpoint["claimed"])
+        checkpoint["claimed"].extend(item_name(item) for item in pending if item_name(item) not in claimed)
+        save_checkpoint(checkpoint, checkpoint_path)
+
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+            futures = {executor.submit(ingest_item, item): item for item in pending}
+            for future in as_completed(futures):
+                item = futures[future]
+                name = item_name(item)
+                try:
+                    completed[name] = future.result()
+                    save_checkpoint(checkpoint, checkpoint_path)
+                    print(f"Processed {name} ({len(completed)}/{len(items)})")
+                except Exception as e:
+                    failures += 1
+                    print(f"Failed to process {name}: {e}")
+                    traceback.print_exc()
+
+    # Insert every finished record that has not made it to the database yet
+    inserted = set(checkpoint["inserted"])
+    to_insert = [name for name in completed if name not in inserted]
+    if to_insert:
+        save_clothes_many([completed[name] for name in to_insert])
+        checkpoint["inserted"].extend(to_insert)
+        save_checkpoint(checkpoint, checkpoint_path)
+        print(f"Inserted {len(to_insert)} records into MongoDB.")
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the upload pipeline for a batch of clothes photos.')
+    parser.add_argument('source', type=str,
+                        help='Directory of images or CSV manifest with path,type,size,color columns')
+    parser.add_argument('--type', type=str, help='Type for every image (directory mode only)')
+    parser.add_argument('--size', type=str, help='Size for every image (directory mode only)')
+    parser.add_argument('--color', type=str, help='Color for every image (directory mode only)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of worker processes (default: number of CPU cores)')
+    parser.add_argument('--checkpoint', type=str, default='batch_checkpoint.json',
+                        help='Checkpoint file used to resume an interrupted import (default: batch_checkpoint.json)')
+
+    args = parser.parse_args()
+
+    if os.path.isdir(args.source):
+        if not all([args.type, args.size, args.color]):
+            parser.error("--type, --size and --color are required when the source is a directory")
+        items = read_directory(args.source, args.type, args.size, args.color)
+    elif os.path.isfile(args.source):
+        items = read_manifest(args.source)
+    else:
+        parser.error(f"Source does not exist: {args.source}")
+
+    try:
+        failures = run_batch(items, args.checkpoint, workers=args.workers)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    if failures:
+        print(f"{failures} items failed; rerun the same command to retry them.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# colors.py
+import numpy as np
+import cv2
+from PIL import Image
+
+# Color bins garments are indexed under
+COLOR_BINS = [
+    "black", "gray", "white", "red", "pink", "orange", "brown", "beige",
+    "yellow", "green", "blue", "navy", "purple",
+]
+
+# Below this Lab chroma a color counts as black, gray or white
+ACHROMATIC_CHROMA = 12
+
+# Pixels with alpha at or below this are background
+ALPHA_THRESHOLD = 127
+# Pixels sampled for clustering; more adds time without changing the result
+MAX_PIXELS = 20000
+# A bin is stored on the document only if it covers at least this share of the garment
+MIN_BIN_SHARE = 0.1
+
+
+def rgb_to_lab(rgb):
+    """
+    Converts an (N, 3) array of 0-255 sRGB values to CIE Lab (L in 0-100).
+    """
+    rgb = np.asarray(rgb, dtype=np.float32).reshape(-1, 1, 3) / 255.0
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2Lab).reshape(-1, 3)
+
+
+def lab_to_hex(lab):
+    rgb = cv2.cvtColor(np.asarray(lab, dtype=np.float32).reshape(1, 1, 3), cv2.COLOR_Lab2RGB).reshape(3)
+    r, g, b = np.clip(np.round(rgb * 255), 0, 255).astype(int)
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
+def color_bin(lab):
+    """
+    Quantizes one Lab color into a COLOR_BINS name using its lightness, chroma and hue angle.
+    """
+    L, a, b = (float(v) for v in lab)
+    chroma = np.hypot(a, b)
+    hue = np.degrees(np.arctan2(b, a)) % 360
+
+    if chroma < ACHROMATIC_CHROMA:
+        return "black" if L < 25 else "white" if L > 82 else "gray"
+    if hue < 20 or hue >= 340:
+        return "pink" if L > 55 else "red"
+    if hue < 50:
+        return "red"
+    if hue < 85:
+        if L < 50:
+            return "brown"
+        return "beige" if chroma < 35 and L > 65 else "orange"
+    if hue < 110:
+        if chroma < 35:
+            return "beige" if L > 65 else "brown"
+        return "yellow" if L >= 60 else "brown"
+    if hue < 200:
+        return "green"
+    if hue < 315:
+        return "navy" if L < 25 else "blue"
+    return "pink" if L > 60 else "purple"
+
+
+def extract_dominant_colors(cutout_path, k=4):
+    """
+    Finds the dominant colors of a garment with k-means in Lab space over the opaque pixels
+    of its cutout, and quantizes them into COLOR_BINS.
+
+    :param cutout_path: Path to the RGBA '<name>_final.png' cutout.
+    :param k: Number of clusters.
+    :return: Dict with 'dominant_colors' (hex, share and bin per cluster, largest first) and
+             'color_bins' (COLOR_BINS names covering at least MIN_BIN_SHARE, largest first).
+    """
+    with Image.open(cutout_path) as image:
+        pixels = np.asarray(image.convert('RGBA')).reshape(-1, 4)
+    pixels = pixels[pixels[:, 3] > ALPHA_THRESHOLD, :3]
+    if len(pixels) == 0:
+        return {"dominant_colors": [], "color_bins": []}
+
+    # Evenly spaced sample keeps the result deterministic
+    if len(pixels) > MAX_PIXELS:
+        pixels = pixels[np.linspace(0, len(pixels) - 1, MAX_PIXELS).astype(int)]
+    lab = rgb_to_lab(pixels)
+
+    k = min(k, len(lab))
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.5)
+    cv2.setRNGSeed(0)
+    _, labels, centers = cv2.kmeans(lab, k, None, criteria, 3, cv2.KMEANS_PP_CENTERS)
+    shares = np.bincount(labels.ravel(), minlength=k) / len(labels)
+
+    bins = [color_bin(center) for center in centers]
+    bin_shares = {}
+    for name, share in zip(bins, shares):
+        bin_shares[name] = bin_shares.get(name, 0.0) + float(share)
+
+    order = np.argsort(-shares)
+    dominant_colors = [
+        {"hex": lab_to_hex(centers[i]), "share": round(float(shares[i]), 3), "bin": bins[i]}
+        for i in order
+    ]
+    color_bins = [
+        name for name, share in sorted(bin_shares.items(), key=lambda item: -item[1])
+        if share >= MIN_BIN_SHARE
+    ]
+    return {"dominant_colors": dominant_colors, "color_bins": color_bins}
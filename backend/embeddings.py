@@ -0,0 +1,51 @@
+# embeddings.py
+import threading
+import numpy as np
+from PIL import Image
+
+# Same CLIP model FastSAM's text prompt uses, so its weights are already cached
+CLIP_MODEL = 'ViT-B/32'
+EMBEDDING_DIM = 512
+DEVICE = 'cpu'
+
+_model = None
+_preprocess = None
+_model_lock = threading.Lock()
+
+
+def load_clip():
+    """
+    Loads CLIP once per process. The import is deferred so the web app only pays for torch
+    when it first embeds an image.
+    """
+    global _model, _preprocess
+    with _model_lock:
+        if _model is None:
+            import clip  # Installed as a FastSAM dependency
+            _model, _preprocess = clip.load(CLIP_MODEL, device=DEVICE)
+            _model.eval()
+    return _model, _preprocess
+
+
+def compute_embedding(cutout_path):
+    """
+    Computes the CLIP image embedding of a garment cutout.
+
+    The transparent background is composited onto white so that only the garment
+    contributes to the embedding.
+
+    :param cutout_path: Path to the RGBA '<name>_final.png' cutout.
+    :return: L2-normalised float32 vector of length EMBEDDING_DIM.
+    """
+    import torch
+
+    model, preprocess = load_clip()
+    with Image.open(cutout_path) as image:
+        image = image.convert('RGBA')
+        background = Image.new('RGBA', image.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, image).convert('RGB')
+
+    with torch.no_grad():
+        features = model.encode_image(preprocess(image).unsqueeze(0).to(DEVICE))
+    vector = features[0].float().cpu().numpy()
+    return (vector / (np.linalg.norm(vector) or 1.0)).astype(np.float32)
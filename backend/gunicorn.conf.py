@@ -0,0 +1,13 @@
+# gunicorn.conf.py
+# Picked up automatically when gunicorn is started from the backend directory.
+# Threaded workers let uploads from several requests share each process's stage pipeline,
+# so segmentation of one upload can overlap with meshing of another.
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+worker_class = "gthread"
+workers = int(os.getenv("GUNICORN_WORKERS", 2))
+# app.py reads the same variable to keep READ_RESERVED_THREADS of these free for reads
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+# Uploads wait for the whole pipeline, which can take minutes on CPU
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 600))
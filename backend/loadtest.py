@@ -0,0 +1,395 @@
+# loadtest.py
+#
+# Load test for the Flask API. Runs app.py in-process against an in-memory MongoDB (mongomock)
+# and a stub segmentation model that writes a synthetic mask, so runs are reproducible on any
+# machine. Cutout, color extraction, thumbnails and meshing run for real (pass --stub_mesh to
+# skip 2D_to_3D.py as well). Results are saved to loadtest_results/ for comparison over time.
+# Install the extra dependencies with: pip install -r requirements-dev.txt
+#
+# Usage:
+#   python loadtest.py --requests 500 --concurrency 8
+#   python loadtest.py --mix getClothes=1,output=1 --baseline loadtest_results/<earlier run>.json
+#
+# The app reads its load-shedding and pipeline settings (GUNICORN_THREADS, SHED_QUEUE_DEPTH,
+# PIPELINE_<STAGE>_WORKERS, ...) from the environment, so set those to test other configurations.
+import os
+import io
+import sys
+import json
+import time
+import zlib
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import Counter
+from datetime import datetime, timezone
+import numpy as np
+import cv2
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_FOLDER = os.path.join(BACKEND_DIR, 'loadtest_results')
+
+# Request types and how to weigh them against each other by default
+DEFAULT_MIX = "uploadClothes=1,getClothes=4,output=4,thumbnail=2,3Doutput=2"
+ENDPOINTS = ("uploadClothes", "getClothes", "output", "thumbnail", "3Doutput")
+
+# Size of the synthetic photos (width, height)
+PHOTO_SIZE = (768, 1024)
+
+
+def garment_ellipse(width, height):
+    """
+    Centre and axes of the garment drawn on synthetic photos and masked by the stub model.
+    """
+    return (width // 2, height // 2), (width // 3, height * 2 // 5)
+
+
+def synthetic_photo(seed, run=0):
+    """
+    Draws a reproducible stand-in for a garment photo: a blurred noise background with a
+    solid ellipse in the middle. Each seed gives a different background, so uploads are not
+    treated as near-duplicates of each other.
+
+    :param run: Separates photo series, e.g. catalogue seeding from the load run.
+    :return: JPEG bytes.
+    """
+    rng = np.random.default_rng([run, seed])
+    width, height = PHOTO_SIZE
+    background = rng.integers(0, 256, size=(height // 64, width // 64, 3), dtype=np.uint8)
+    image = cv2.resize(background, (width, height), interpolation=cv2.INTER_LINEAR)
+    center, axes = garment_ellipse(width, height)
+    color = tuple(int(c) for c in rng.integers(0, 256, 3))
+    cv2.ellipse(image, center, axes, 0, 0, 360, color, -1)
+
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def stub_segment_stage(job):
+    """
+    Stands in for FastSAM (run.py): writes the scaled image and an elliptical mask the way
+    run.py names them.
+    """
+    from pipeline import OUTPUT_FOLDER
+
+    with Image.open(job["image"]) as image:
+        image = image.convert('RGB')
+        image.thumbnail((1024, 1024))
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    image.save(os.path.join(OUTPUT_FOLDER, f"{job['name']}_scaled.jpg"))
+
+    width, height = image.size
+    mask = np.zeros((height, width), dtype=np.uint8)
+    center, axes = garment_ellipse(width, height)
+    cv2.ellipse(mask, center, axes, 0, 0, 360, 255, -1)
+    mask_path = os.path.join(OUTPUT_FOLDER, f"{job['name']}_mask.png")
+    Image.fromarray(mask).save(mask_path)
+    job["mask"] = mask_path
+    return job
+
+
+def stub_embed_stage(job):
+    """
+    Stands in for CLIP: adds a random vector seeded by the item name to the similarity index.
+    """
+    from pipeline import embedding_index
+    from embeddings import EMBEDDING_DIM
+
+    rng = np.random.default_rng(zlib.crc32(job["name"].encode()))
+    embedding_index.add(job["name"], rng.standard_normal(EMBEDDING_DIM).astype(np.float32))
+    return job
+
+
+def stub_mesh_stage(job):
+    """
+    Writes a two-triangle OBJ instead of running 2D_to_3D.py.
+    """
+    from pipeline import THREED_FOLDER
+
+    os.makedirs(THREED_FOLDER, exist_ok=True)
+    output_obj_path = os.path.join(THREED_FOLDER, f"{job['name']}.obj")
+    with open(output_obj_path, "w") as f:
+        f.write("v 0 0 0\nv 1 0 0\nv 1 1 0\nv 0 1 0\nf 1 2 3\nf 1 3 4\n")
+    job["3D_model"] = output_obj_path
+    return job
+
+
+def install_stubs(stub_mesh=False):
+    """
+    Points mongodb_handler at one shared mongomock client and swaps the model stages of the
+    pipeline for stubs. Must run before app is imported, since app builds its stage pipeline
+    from pipeline.STAGES at import time.
+    """
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit("loadtest.py needs the dev requirements: pip install -r requirements-dev.txt")
+    import mongodb_handler
+    import pipeline
+
+    client = mongomock.MongoClient()
+    mongodb_handler.MongoClient = lambda *args, **kwargs: client
+
+    stubs = {"segmentation": stub_segment_stage, "embedding": stub_embed_stage}
+    if stub_mesh:
+        stubs["meshing"] = stub_mesh_stage
+    pipeline.STAGES[:] = [
+        (name, pipeline.skip_if_duplicate(stubs[name]) if name in stubs else stage)
+        for name, stage in pipeline.STAGES
+    ]
+
+
+def parse_mix(mix):
+    """
+    Parses 'endpoint=weight,...' into a dict of endpoint -> weight.
+    """
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint '{name}', expected one of: {', '.join(ENDPOINTS)}")
+        weights[name] = float(weight or 1)
+    if sum(weights.values()) <= 0:
+        raise ValueError("The request mix needs at least one positive weight")
+    return weights
+
+
+def build_request(endpoint, index, catalogue):
+    """
+    :return: (method, path, keyword arguments for the test client) of one request.
+    """
+    name = catalogue[index % len(catalogue)]
+    if endpoint == "uploadClothes":
+        data = {
+            "type": "shirt",
+            "size": "M",
+            "color": "blue",
+            "photo": (io.BytesIO(synthetic_photo(index)), f"load_{index}.jpg"),
+        }
+        return "POST", "/uploadClothes", {"data": data, "content_type": "multipart/form-data"}
+    if endpoint == "getClothes":
+        return "GET", "/getClothes", {}
+    if endpoint == "output":
+        return "GET", f"/output/{name}", {"headers": {"Accept-Encoding": "gzip, br"}}
+    if endpoint == "thumbnail":
+        return "GET", f"/output/{name}?size=320", {"headers": {"Accept": "image/avif,image/webp,*/*"}}
+    return "GET", f"/3Doutput/{name}", {"headers": {"Accept-Encoding": "gzip, br"}}
+
+
+def send(client, method, path, kwargs):
+    """
+    Sends one request and reads the whole body.
+
+    :return: (latency in seconds, status code).
+    """
+    start = time.perf_counter()
+    response = client.open(path, method=method, **kwargs)
+    response.get_data()
+    elapsed = time.perf_counter() - start
+    response.close()
+    return elapsed, response.status_code
+
+
+def seed_catalogue(app, count):
+    """
+    Uploads count items one by one so the read endpoints have something to serve.
+
+    :return: Names of the uploaded items.
+    """
+    client = app.test_client()
+    names = []
+    for i in range(count):
+        name = f"seed_{i}"
+        data = {
+            "type": "shirt",
+            "size": "M",
+            "color": "blue",
+            "photo": (io.BytesIO(synthetic_photo(i, run=1)), f"{name}.jpg"),
+        }
+        response = client.post('/uploadClothes', data=data, content_type='multipart/form-data')
+        if response.status_code != 201:
+            raise RuntimeError(f"Seeding {name} failed with {response.status_code}: {response.get_data(as_text=True)}")
+        names.append(name)
+        print(f"Seeded {name} ({i + 1}/{count})")
+    return names
+
+
+def run_load(app, mix, requests, concurrency, catalogue, seed=0):
+    """
+    Sends requests drawn from the mix from concurrency threads, each with its own test client.
+
+    :return: (dict of endpoint -> list of (latency, status), wall-clock seconds).
+    """
+    names = list(mix)
+    weights = np.array([mix[name] for name in names])
+    plan = np.random.default_rng(seed).choice(names, size=requests, p=weights / weights.sum())
+
+    samples = {name: [] for name in names}
+    lock = threading.Lock()
+    next_index = [0]
+
+    def worker():
+        client = app.test_client()
+        while True:
+            with lock:
+                index = next_index[0]
+                next_index[0] += 1
+            if index >= requests:
+                return
+            endpoint = str(plan[index])
+            # Built before the clock starts so photo encoding is not counted as latency
+            method, path, kwargs = build_request(endpoint, index, catalogue)
+            sample = send(client, method, path, kwargs)
+            with lock:
+                samples[endpoint].append(sample)
+
+    threads = [threading.Thread(target=worker, name=f"loadtest-{n}") for n in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - start
+
+
+def summarize(samples, wall_seconds):
+    """
+    Latency percentiles (milliseconds), status counts and throughput of a list of samples.
+    """
+    if not samples:
+        return {"requests": 0, "status": {}}
+    latencies = np.array([latency for latency, _ in samples]) * 1000
+    statuses = Counter(str(status) for _, status in samples)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "requests": len(samples),
+        "status": dict(sorted(statuses.items())),
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "mean_ms": round(float(latencies.mean()), 2),
+        "max_ms": round(float(latencies.max()), 2),
+        "rps": round(len(samples) / wall_seconds, 2),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results, baseline=None):
+    """
+    Prints one row per endpoint; with a baseline, p95 and req/s are followed by the change.
+    """
+    rows = list(results["endpoints"].items()) + [("all", results["overall"])]
+    print(f"\n{'endpoint':<14}{'requests':>9}{'p50 ms':>10}{'p95 ms':>18}{'p99 ms':>10}{'req/s':>18}  status")
+    for name, stats in rows:
+        if not stats["requests"]:
+            continue
+        p95, rps = f"{stats['p95_ms']:.1f}", f"{stats['rps']:.1f}"
+        if baseline:
+            before = baseline["overall"] if name == "all" else baseline["endpoints"].get(name)
+            if before and before.get("requests"):
+                p95 += f" ({stats['p95_ms'] - before['p95_ms']:+.1f})"
+                rps += f" ({stats['rps'] - before['rps']:+.1f})"
+        status = ", ".join(f"{code}: {count}" for code, count in stats["status"].items())
+        print(f"{name:<14}{stats['requests']:>9}{stats['p50_ms']:>10.1f}{p95:>18}{stats['p99_ms']:>10.1f}{rps:>18}  {status}")
+
+
+def save_results(results, results_folder=RESULTS_FOLDER):
+    os.makedirs(results_folder, exist_ok=True)
+    path = os.path.join(results_folder, f"{results['timestamp'].replace(':', '')}.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the Flask API with a stubbed model and database.')
+    parser.add_argument('--requests', type=int, default=200, help='Number of requests to send (default: 200)')
+    parser.add_argument('--concurrency', type=int, default=8, help='Number of concurrent clients (default: 8)')
+    parser.add_argument('--mix', type=str, default=DEFAULT_MIX,
+                        help=f'Relative weight of each request type (default: {DEFAULT_MIX})')
+    parser.add_argument('--seed_items', type=int, default=5,
+                        help='Items uploaded before the run for the read endpoints to serve (default: 5)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the request order (default: 0)')
+    parser.add_argument('--stub_mesh', action='store_true', help='Write a placeholder OBJ instead of running 2D_to_3D.py')
+    parser.add_argument('--baseline', type=str, default=None, help='Earlier results file to compare against')
+    parser.add_argument('--results_dir', type=str, default=RESULTS_FOLDER,
+                        help='Folder the results are saved to (default: backend/loadtest_results)')
+    parser.add_argument('--keep_workdir', action='store_true', help='Keep the temporary folder with the generated files')
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.seed_items < 1:
+        parser.error("--seed_items must be at least 1")
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    results_dir = os.path.abspath(args.results_dir)
+
+    # The app and pipeline use folders relative to the working directory
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+    os.chdir(workdir)
+    print(f"Working directory: {workdir}")
+
+    try:
+        if BACKEND_DIR not in sys.path:
+            sys.path.insert(0, BACKEND_DIR)
+        install_stubs(stub_mesh=args.stub_mesh)
+        import app as app_module
+        # Per-request INFO logs would dominate the output
+        logging.getLogger().setLevel(logging.WARNING)
+        app = app_module.app
+
+        catalogue = seed_catalogue(app, args.seed_items)
+        print(f"Sending {args.requests} requests from {args.concurrency} clients...")
+        samples, wall_seconds = run_load(app, mix, args.requests, args.concurrency, catalogue, seed=args.seed)
+
+        results = {
+            "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "commit": git_commit(),
+            "config": {
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "mix": mix,
+                "seed_items": args.seed_items,
+                "seed": args.seed,
+                "stub_mesh": args.stub_mesh,
+                "upload_slots": app_module.UPLOAD_SLOTS,
+                "degrade_queue_depth": app_module.DEGRADE_QUEUE_DEPTH,
+                "shed_queue_depth": app_module.SHED_QUEUE_DEPTH,
+                "cpu_count": os.cpu_count(),
+            },
+            "wall_seconds": round(wall_seconds, 3),
+            "endpoints": {name: summarize(endpoint_samples, wall_seconds) for name, endpoint_samples in samples.items()},
+            "overall": summarize([sample for endpoint_samples in samples.values() for sample in endpoint_samples], wall_seconds),
+            "pipeline": app_module.upload_pipeline.stats(),
+        }
+    finally:
+        os.chdir(BACKEND_DIR)
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(results, baseline)
+    print(f"\nResults saved to {save_results(results, results_dir)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 # mongodb_handler.py
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateMany
 import logging
 import time
 import os
@@ -12,6 +12,21 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_indexes_created = False
+
+
+def ensure_indexes(db):
+    """
+    Creates the indexes the queries below rely on, once per process.
+    """
+    global _indexes_created
+    if _indexes_created:
+        return
+    clothes_collection = db["clothes"]
+    clothes_collection.create_index("photo_filename")
+    clothes_collection.create_index("color_bins")
+    _indexes_created = True
+
 # MongoDB connection setup
 def get_db_connection():
     try:
@@ -21,6 +36,7 @@ def get_db_connection():
             tlsAllowInvalidCertificates=True
         )
         db = client["Cluster0"]
+        ensure_indexes(db)
         logger.info("Successfully connected to MongoDB.")
         return db
     except Exception as e:
@@ -39,14 +55,81 @@ def save_clothes(type, size, color, filename):
         "photo_filename": filename  # Save the file name in the MongoDB entry
     }
     
-    clothes_collection.insert_one(clothes_data)
+    # The _id lets the upload route update this document even if the filename is reused
+    return clothes_collection.insert_one(clothes_data).inserted_id
 
     #success("Clothes saved successfully!")
 
 
-def get_all_clothes():
+def save_clothes_many(records):
+    """
+    Saves a batch of clothes records with a single insert_many call.
+    Each record needs the same fields as save_clothes (type, size, color, photo_filename).
+    """
+    if not records:
+        return
+    db = get_db_connection()
+    clothes_collection = db["clothes"]
+    clothes_collection.insert_many([dict(record) for record in records])
+
+
+def update_clothes(clothes_id, fields):
+    """
+    Sets extra fields (e.g. the extracted colors) on one clothes document.
+
+    :param clothes_id: The _id returned by save_clothes.
+    """
+    db = get_db_connection()
+    clothes_collection = db["clothes"]
+    clothes_collection.update_one({"_id": clothes_id}, {"$set": fields})
+
+
+def find_filenames_missing(field):
+    """
+    Returns the photo_filename of every clothes document that lacks field
+    (e.g. documents saved before the pipeline extracted colors).
+    """
+    db = get_db_connection()
+    clothes_collection = db["clothes"]
+    return sorted(clothes_collection.distinct("photo_filename", {field: {"$exists": False}}))
+
+
+def backfill_clothes(field, updates):
+    """
+    Sets fields on the clothes documents that still lack field, with a single bulk_write.
+    Documents that already have field (e.g. a newer upload under the same name) are left alone.
+
+    :param updates: Dict mapping a photo_filename to the fields to set.
+    """
+    if not updates:
+        return
+    db = get_db_connection()
+    clothes_collection = db["clothes"]
+    clothes_collection.bulk_write([
+        UpdateMany({"photo_filename": filename, field: {"$exists": False}}, {"$set": fields})
+        for filename, fields in updates.items()
+    ], ordered=False)
+
+
+def get_all_clothes(color=None):
     db = get_db_connection()  # Ensure this is defined to connect to MongoDB
     clothes_collection = db["clothes"]
-    
-    clothes = list(clothes_collection.find({}, {"_id": 0}))
-    return clothes
\ No newline at end of file
+
+    # color filters on the extracted color bins, which are indexed
+    query = {"color_bins": color} if color else {}
+    clothes = list(clothes_collection.find(query, {"_id": 0}))
+    return clothes
+
+def get_clothes_by_filenames(filenames):
+    """
+    Fetches the clothes with the given photo_filename values, in the same order.
+    Filenames without a document are skipped.
+    """
+    db = get_db_connection()
+    clothes_collection = db["clothes"]
+
+    found = {
+        clothes["photo_filename"]: clothes
+        for clothes in clothes_collection.find({"photo_filename": {"$in": list(filenames)}}, {"_id": 0})
+    }
+    return [found[filename] for filename in filenames if filename in found]
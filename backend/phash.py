@@ -0,0 +1,171 @@
+# phash.py
+import os
+import json
+import threading
+from functools import lru_cache
+from itertools import combinations
+import numpy as np
+import cv2
+from PIL import Image
+
+from vector_index import file_lock
+
+# Same cap run.py scales uploads down to before segmentation
+MAX_DIM = 1024
+# Largest Hamming distance (out of 64 bits) at which two photos count as the same garment
+DUPLICATE_DISTANCE = int(os.getenv("PHASH_DUPLICATE_DISTANCE", 8))
+
+
+def load_thumbnail(image_path):
+    """
+    Opens an image scaled down the same way run.py does before segmentation.
+    """
+    with Image.open(image_path) as image:
+        image = image.convert('RGB')
+        image.thumbnail((MAX_DIM, MAX_DIM))
+    return image
+
+
+def phash(image):
+    """
+    64-bit DCT perceptual hash: the signs of the 8x8 lowest-frequency DCT coefficients of the
+    32x32 grayscale image, relative to their median. Robust to rescaling, recompression and
+    small crops.
+    """
+    gray = np.asarray(image.convert('L').resize((32, 32), Image.LANCZOS), dtype=np.float32)
+    low = cv2.dct(gray)[:8, :8].ravel()
+    bits = low > np.median(low[1:])  # The DC term would skew the median
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class MultiIndexHashTable:
+    """
+    Multi-index hashing over 64-bit hashes: each hash is split into four 16-bit chunks, each
+    with its own table. If two hashes are within Hamming distance r, at least one of their
+    chunks differs in at most r // 4 bits (pigeonhole), so a radius query only has to look up
+    the chunk values within that distance in each table and check the few candidates found.
+    With r=8 that is 4 x 137 dictionary lookups, well under a millisecond at 100k hashes.
+    """
+    CHUNKS = 4
+    CHUNK_BITS = 16
+
+    def __init__(self):
+        self.tables = [{} for _ in range(self.CHUNKS)]
+        self.names = {}  # hash -> [names]
+        self.hashes = {}  # name -> hash
+        self.size = 0
+
+    def _chunks(self, hash):
+        mask = (1 << self.CHUNK_BITS) - 1
+        return [(hash >> (i * self.CHUNK_BITS)) & mask for i in range(self.CHUNKS)]
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def _flip_masks(cls, radius):
+        # Every XOR mask with at most `radius` bits set within one chunk
+        return tuple(
+            sum(1 << bit for bit in bits)
+            for r in range(radius + 1)
+            for bits in combinations(range(cls.CHUNK_BITS), r)
+        )
+
+    def add(self, hash, name):
+        """
+        Stores hash under name, replacing the hash the name had before.
+        """
+        if name in self.hashes:
+            self.remove(name)
+        self.hashes[name] = hash
+        self.size += 1
+        if hash in self.names:
+            self.names[hash].append(name)
+            return
+        self.names[hash] = [name]
+        for table, chunk in zip(self.tables, self._chunks(hash)):
+            table.setdefault(chunk, []).append(hash)
+
+    def remove(self, name):
+        hash = self.hashes.pop(name)
+        self.size -= 1
+        self.names[hash].remove(name)
+        if self.names[hash]:
+            return
+        del self.names[hash]
+        for table, chunk in zip(self.tables, self._chunks(hash)):
+            bucket = table[chunk]
+            bucket.remove(hash)
+            if not bucket:
+                del table[chunk]
+
+    def find(self, hash, radius):
+        """
+        :return: List of (distance, name) within radius, closest first.
+        """
+        chunk_radius = radius // self.CHUNKS
+        masks = self._flip_masks(chunk_radius)
+        candidates = set()
+        for table, chunk in zip(self.tables, self._chunks(hash)):
+            for mask in masks:
+                bucket = table.get(chunk ^ mask)
+                if bucket:
+                    candidates.update(bucket)
+
+        matches = []
+        for candidate in candidates:
+            distance = hamming(hash, candidate)
+            if distance <= radius:
+                matches.extend((distance, name) for name in self.names[candidate])
+        return sorted(matches)
+
+
+class HashIndex:
+    """
+    Perceptual hashes of every processed garment, persisted as an append-only JSONL file and
+    kept in a MultiIndexHashTable. Re-adding a name (a re-upload with another photo) appends a
+    new line that replaces the name's earlier hash. Each process picks up lines appended by
+    other processes on its next lookup.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.lock = threading.Lock()
+        self.table = MultiIndexHashTable()
+        self.loaded_size = 0
+
+    def _refresh(self):
+        # Must be called with self.lock held; only reads the lines added since the last refresh
+        if not os.path.isfile(self.path) or os.path.getsize(self.path) == self.loaded_size:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self.loaded_size)
+            data = f.read()
+        # Ignore a line another process is still writing
+        data = data[:data.rfind(b"\n") + 1]
+        for line in data.splitlines():
+            if line.strip():
+                entry = json.loads(line)
+                self.table.add(int(entry["hash"], 16), entry["name"])
+        self.loaded_size += len(data)
+
+    def add(self, name, hash):
+        with self.lock:
+            with file_lock(self.lock_path):
+                with open(self.path, "a") as f:
+                    f.write(json.dumps({"name": name, "hash": f"{hash:016x}"}) + "\n")
+            self._refresh()
+
+    def find_duplicate(self, hash, radius=DUPLICATE_DISTANCE, exclude=None):
+        """
+        :return: Name of the closest stored garment within radius, or None.
+        """
+        with self.lock:
+            self._refresh()
+            matches = self.table.find(hash, radius)
+        for _, name in matches:
+            if name != exclude:
+                return name
+        return None
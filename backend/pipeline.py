@@ -0,0 +1,332 @@
+# pipeline.py
+import os
+import sys
+import glob
+import shutil
+import subprocess
+from functools import wraps
+from PIL import Image
+from thumbnails import THUMBNAIL_FOLDER, THUMBNAIL_WIDTHS, available_formats, generate_thumbnails, thumbnail_filename
+from artifacts import precompress
+from colors import extract_dominant_colors
+from embeddings import EMBEDDING_DIM, compute_embedding
+from vector_index import VectorIndex
+from phash import DUPLICATE_DISTANCE, HashIndex, hamming, load_thumbnail, phash
+
+# Absolute path of the backend directory; the scripts themselves still expect
+# to be run with the backend directory as the working directory
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+UPLOAD_FOLDER = './uploads'
+OUTPUT_FOLDER = './output'
+THREED_FOLDER = './3Doutput'
+# Height maps persisted by 2D_to_3D.py so meshes can be rebuilt without segmentation (see remesh.py)
+INTERMEDIATE_FOLDER = './intermediate'
+INDEX_FOLDER = './index'
+
+# OBJ/MTL lines that carry the model's name, as written by 2D_to_3D.py and Open3D
+RENAMED_KEYWORDS = ("# object name: ", "mtllib ", "usemtl ", "newmtl ")
+
+
+def base_name(path):
+    """
+    Returns the file name without directory and extension (e.g. 'uploads/P0_5.jpg' -> 'P0_5').
+    """
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def stage_upload(source_path, filename=None):
+    """
+    Copies an image into the uploads folder the same way /uploadClothes stores it.
+
+    :param source_path: Path to the original image.
+    :param filename: Name to store the image under (defaults to the source base name).
+    :return: Path of the stored image.
+    """
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    local_image_path = os.path.join(UPLOAD_FOLDER, filename or base_name(source_path))
+    if os.path.abspath(source_path) != os.path.abspath(local_image_path):
+        shutil.copyfile(source_path, local_image_path)
+    return local_image_path
+
+
+def run_script(script, *args):
+    """
+    Runs one of the backend scripts with the current interpreter.
+    Raises subprocess.CalledProcessError if the script fails.
+    """
+    command = [sys.executable, os.path.join(BACKEND_DIR, script), *args]
+    subprocess.run(command, check=True)
+
+
+# Image embeddings of every garment cutout, keyed by photo_filename (backs /similar/<id>)
+embedding_index = VectorIndex(os.path.join(INDEX_FOLDER, 'embeddings'), dim=EMBEDDING_DIM)
+# Perceptual hashes of every processed upload, used to spot re-uploads of the same photo
+phash_index = HashIndex(os.path.join(INDEX_FOLDER, 'phash.jsonl'))
+
+# Text prompt FastSAM uses to pick the garment out of the photo
+TEXT_PROMPT = "shirt"
+
+# Quality profiles. Under load the app switches new uploads to the cheaper profile:
+# smaller FastSAM input, no retina masks, a coarser height map and a triangle budget.
+PROFILES = {
+    "full": {"imgsz": None, "retina_masks": True, "downscale_factor": 4, "max_triangles": None},
+    "degraded": {"imgsz": 512, "retina_masks": False, "downscale_factor": 8, "max_triangles": 20000},
+}
+
+
+def new_job(local_image_path, profile="full"):
+    """
+    Creates the job dict that is passed from stage to stage.
+
+    :param profile: Key of PROFILES to process the upload with.
+    """
+    return {
+        "name": base_name(local_image_path),
+        "image": local_image_path,
+        "profile": profile,
+        # Fields the pipeline adds to the item's Mongo document
+        "fields": {},
+    }
+
+
+def skip_if_duplicate(stage):
+    """
+    Lets a job whose artefacts were copied from a near-duplicate pass through the stage untouched.
+    """
+    @wraps(stage)
+    def wrapper(job):
+        if job.get("duplicate_of"):
+            return job
+        return stage(job)
+    return wrapper
+
+
+def decode_stage(job):
+    """
+    Checks that the uploaded file is a readable image before any model work is spent on it.
+    """
+    with Image.open(job["image"]) as image:
+        image.verify()
+    return job
+
+
+def dedup_stage(job):
+    """
+    Computes the perceptual hash of the scaled-down upload. If an already processed garment
+    is within DUPLICATE_DISTANCE, its artefacts are copied under this upload's name and the
+    remaining stages are skipped.
+    """
+    job["phash"] = phash(load_thumbnail(job["image"]))
+    job["fields"]["phash"] = f"{job['phash']:016x}"
+
+    duplicate = phash_index.find_duplicate(job["phash"], exclude=job["name"])
+    if duplicate and not matches_current_upload(duplicate, job["phash"]):
+        # The source has been re-uploaded with another photo that is still being processed
+        duplicate = None
+    if duplicate and reuse_artifacts(duplicate, job):
+        print(f"{job['name']} is a near-duplicate of {duplicate}; reusing its artefacts.")
+        job["duplicate_of"] = duplicate
+        job["fields"]["duplicate_of"] = duplicate
+    return job
+
+
+def matches_current_upload(name, hash, radius=DUPLICATE_DISTANCE):
+    """
+    Checks that the photo currently stored under name is still within radius of hash, since the
+    hash index only learns about a re-upload once it has gone through every stage.
+    """
+    path = os.path.join(UPLOAD_FOLDER, name)
+    try:
+        return hamming(phash(load_thumbnail(path)), hash) <= radius
+    except OSError:
+        # Missing, or still being written by the upload route
+        return False
+
+
+def reuse_artifacts(source, job):
+    """
+    Copies a processed garment's artefacts (cutout, mask, mesh, thumbnails, height maps and
+    embedding) to the job's name and fills in the job as if the stages had run.
+
+    :return: False if the source is missing its cutout or mesh, in which case nothing is copied.
+    """
+    name = job["name"]
+    source_image = os.path.join(OUTPUT_FOLDER, f"{source}_final.png")
+    source_model = os.path.join(THREED_FOLDER, f"{source}.obj")
+    if not (os.path.isfile(source_image) and os.path.isfile(source_model)):
+        return False
+
+    pairs = [
+        (os.path.join(OUTPUT_FOLDER, f"{source}{suffix}"), os.path.join(OUTPUT_FOLDER, f"{name}{suffix}"))
+        for suffix in ("_final.png", "_mask.png", "_scaled.jpg")
+    ]
+    pairs += [
+        (os.path.join(THREED_FOLDER, f"{source}{suffix}"), os.path.join(THREED_FOLDER, f"{name}{suffix}"))
+        for suffix in (".obj", ".mtl")
+    ]
+    pairs += [
+        (os.path.join(THUMBNAIL_FOLDER, thumbnail_filename(source, width, fmt)),
+         os.path.join(THUMBNAIL_FOLDER, thumbnail_filename(name, width, fmt)))
+        for fmt in available_formats() for width in THUMBNAIL_WIDTHS
+    ]
+    for path in glob.glob(os.path.join(INTERMEDIATE_FOLDER, f"{glob.escape(source)}_final_height_a*.npz")):
+        suffix = os.path.basename(path)[len(source):]
+        pairs.append((path, os.path.join(INTERMEDIATE_FOLDER, f"{name}{suffix}")))
+
+    # Copies rather than hard links: the scripts rewrite some of these files in place
+    for source_path, target_path in pairs:
+        if not os.path.isfile(source_path):
+            continue
+        if source_path.endswith((".obj", ".mtl")):
+            copy_renamed_model(source_path, target_path, source, name)
+        else:
+            shutil.copyfile(source_path, target_path)
+
+    vector = embedding_index.get(source)
+    if vector is not None:
+        embedding_index.add(name, vector)
+
+    job["processed_image"] = os.path.join(OUTPUT_FOLDER, f"{name}_final.png")
+    job["3D_model"] = os.path.join(THREED_FOLDER, f"{name}.obj")
+    job["compressed"] = precompress_model(job["3D_model"])
+    job["colors"] = extract_dominant_colors(job["processed_image"])
+    job["fields"].update(job["colors"])
+    return True
+
+
+def copy_renamed_model(source_path, target_path, source, name):
+    """
+    Copies an OBJ or MTL file, renaming the object, its MTL file and its materials from the source's
+    name to the new name so the copy does not refer to the source's files.
+    """
+    with open(source_path, newline="") as src, open(target_path, "w", newline="") as dst:
+        for line in src:
+            for keyword in RENAMED_KEYWORDS:
+                if line.startswith(keyword) and line[len(keyword):].startswith(source):
+                    line = keyword + name + line[len(keyword) + len(source):]
+                    break
+            dst.write(line)
+
+
+@skip_if_duplicate
+def segment_stage(job):
+    """
+    Runs FastSAM (run.py) with the job's quality profile to produce the '<name>_mask.png' mask.
+    """
+    profile = PROFILES[job.get("profile", "full")]
+    args = [job["image"], TEXT_PROMPT]
+    if profile["imgsz"]:
+        args += ["--imgsz", str(profile["imgsz"])]
+    if not profile["retina_masks"]:
+        args.append("--no_retina")
+    run_script("run.py", *args)
+
+    mask_path = os.path.join(OUTPUT_FOLDER, f"{job['name']}_mask.png")
+    if not os.path.isfile(mask_path):
+        raise FileNotFoundError(f"Mask file was not created: {mask_path}")
+    job["mask"] = mask_path
+    return job
+
+
+@skip_if_duplicate
+def postprocess_stage(job):
+    """
+    Cleans the mask and cuts the garment out (process.py), crops the transparent margins (cv_square.py)
+    and extracts the garment's dominant colors from the cutout.
+    """
+    processed_image_path = os.path.join(OUTPUT_FOLDER, f"{job['name']}_final.png")
+    run_script("process.py", job["image"], processed_image_path)
+    run_script("cv_square.py", processed_image_path)
+
+    if not os.path.exists(processed_image_path):
+        raise FileNotFoundError(f"Processed image not found: {processed_image_path}")
+    job["processed_image"] = processed_image_path
+    job["colors"] = extract_dominant_colors(processed_image_path)
+    job["fields"].update(job["colors"])
+    return job
+
+
+@skip_if_duplicate
+def embed_stage(job):
+    """
+    Computes the CLIP embedding of the cutout and adds it to the similarity index.
+    """
+    embedding_index.add(job["name"], compute_embedding(job["processed_image"]))
+    return job
+
+
+@skip_if_duplicate
+def mesh_stage(job):
+    """
+    Runs 2D_to_3D.py on the cutout with the job's quality profile.
+    """
+    output_obj_path = os.path.join(THREED_FOLDER, f"{job['name']}.obj")
+    profile = PROFILES[job.get("profile", "full")]
+    args = [
+        job["processed_image"], output_obj_path,
+        "--cache_dir", INTERMEDIATE_FOLDER,
+        "--downscale_factor", str(profile["downscale_factor"]),
+    ]
+    if profile["max_triangles"]:
+        args += ["--max_triangles", str(profile["max_triangles"])]
+    run_script("2D_to_3D.py", *args)
+    job["3D_model"] = output_obj_path
+    return job
+
+
+@skip_if_duplicate
+def encode_stage(job):
+    """
+    Final stage: checks the mesh was written, encodes the thumbnail variants of the cutout,
+    precompresses the OBJ/MTL files for serving and records the upload's perceptual hash so
+    later re-uploads can reuse these artefacts.
+    """
+    if not os.path.isfile(job["3D_model"]):
+        raise FileNotFoundError(f"3D model not found: {job['3D_model']}")
+    job["thumbnails"] = generate_thumbnails(job["processed_image"], job["name"])
+
+    job["compressed"] = precompress_model(job["3D_model"])
+
+    if job.get("phash") is not None:
+        phash_index.add(job["name"], job["phash"])
+    return job
+
+
+def precompress_model(obj_path):
+    """
+    Writes the compressed variants of an OBJ file and its MTL file.
+
+    :return: List of the variant paths.
+    """
+    mtl_path = os.path.splitext(obj_path)[0] + ".mtl"
+    paths = []
+    for path in (obj_path, mtl_path):
+        if os.path.isfile(path):
+            paths.extend(precompress(path))
+    return paths
+
+
+# Stages in the order they run; used by both the batch CLI and the stage-parallel executor
+STAGES = [
+    ("decode", decode_stage),
+    ("dedup", dedup_stage),
+    ("segmentation", segment_stage),
+    ("postprocess", postprocess_stage),
+    ("embedding", embed_stage),
+    ("meshing", mesh_stage),
+    ("encode", encode_stage),
+]
+
+
+def process_item(local_image_path):
+    """
+    Runs the whole upload pipeline (segmentation, cutout and meshing) for one stored image.
+
+    :param local_image_path: Path of the image inside the uploads folder.
+    :return: Job dict with the paths of the generated artefacts.
+    """
+    job = new_job(local_image_path)
+    for _, stage in STAGES:
+        job = stage(job)
+    return job
@@ -0,0 +1,147 @@
+import os
+import sys
+import fcntl
+import argparse
+import importlib
+import traceback
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from pipeline import OUTPUT_FOLDER, THREED_FOLDER, INTERMEDIATE_FOLDER, precompress_model
+
+# Same downscale factor 2D_to_3D.py uses when the upload pipeline runs it
+DEFAULT_DOWNSCALE_FACTOR = 4
+
+# Held while a remesh runs, so that only one runs at a time across processes
+REMESH_LOCK_PATH = os.path.join(INTERMEDIATE_FOLDER, "remesh.lock")
+
+
+def list_items():
+    """
+    Returns the names of every item that has a cleaned cutout in the output folder.
+    """
+    suffix = "_final.png"
+    return sorted(f[:-len(suffix)] for f in os.listdir(OUTPUT_FOLDER) if f.endswith(suffix))
+
+
+def remesh_item(name, scale=(1.0, 1.0, 1.0), alpha_threshold=10, downscale_factor=DEFAULT_DOWNSCALE_FACTOR):
+    """
+    Rebuilds one item's mesh from its persisted cutout and height map, skipping segmentation.
+
+    :return: Path to the regenerated OBJ file.
+    """
+    processed_image_path = os.path.join(OUTPUT_FOLDER, f"{name}_final.png")
+    if not os.path.isfile(processed_image_path):
+        raise FileNotFoundError(f"Processed image not found: {processed_image_path}")
+
+    # The module name starts with a digit, so it can't be imported with a plain import statement
+    mesher = importlib.import_module("2D_to_3D")
+    output_obj_path = os.path.join(THREED_FOLDER, f"{name}.obj")
+    mesher.generate_3d_model(
+        processed_image_path,
+        output_obj_path,
+        scale=tuple(scale),
+        alpha_threshold=alpha_threshold,
+        downscale_factor=downscale_factor,
+        cache_dir=INTERMEDIATE_FOLDER
+    )
+    precompress_model(output_obj_path)
+    return output_obj_path
+
+
+def create_pool(workers=None):
+    """
+    Creates a process pool for re-meshing. Its workers are spawned rather than forked, so the
+    pool can be used from a multithreaded process (a gunicorn gthread worker) without the
+    children inheriting locks held by other threads.
+
+    :param workers: Number of worker processes (default: number of CPU cores).
+    """
+    workers = workers or os.cpu_count() or 1
+    return ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+
+
+def try_remesh_lock():
+    """
+    Takes REMESH_LOCK_PATH without waiting.
+
+    :return: The open lock file (close it to release the lock), or None if a remesh is already running.
+    """
+    os.makedirs(INTERMEDIATE_FOLDER, exist_ok=True)
+    lock_file = open(REMESH_LOCK_PATH, "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def remesh_items(names, workers=None, executor=None, **mesh_args):
+    """
+    Rebuilds the meshes of several items in parallel.
+
+    :param names: Item names (as stored in photo_filename).
+    :param workers: Number of worker processes (default: number of CPU cores).
+    :param executor: Existing pool to run on (see create_pool); by default a pool is created for this call.
+    :param mesh_args: Keyword arguments passed to remesh_item.
+    :return: Tuple of (dict of name -> OBJ path, dict of name -> error message).
+    """
+    results, errors = {}, {}
+    if not names:
+        return results, errors
+    if executor is None:
+        workers = workers or os.cpu_count() or 1
+        with create_pool(min(workers, len(names))) as executor:
+            return remesh_items(names, executor=executor, **mesh_args)
+
+    futures = {executor.submit(remesh_item, name, **mesh_args): name for name in names}
+    for future in as_completed(futures):
+        name = futures[future]
+        try:
+            results[name] = future.result()
+            print(f"Re-meshed {name}")
+        except BrokenProcessPool:
+            # A worker died; the pool cannot run anything else
+            raise
+        except Exception as e:
+            errors[name] = str(e)
+            print(f"Failed to re-mesh {name}: {e}")
+            traceback.print_exc()
+    return results, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild 3D meshes from the persisted cutouts and height maps.')
+    parser.add_argument('names', nargs='*', help='Items to re-mesh (as stored in photo_filename)')
+    parser.add_argument('--all', action='store_true', help='Re-mesh every item in the catalogue')
+    parser.add_argument('--scale', nargs=3, type=float, default=[1.0, 1.0, 1.0],
+                        help='Scale factors for x, y, z axes (default: 1.0 1.0 1.0)')
+    parser.add_argument('--alpha_threshold', type=int, default=10,
+                        help='Alpha threshold for transparency (default: 10)')
+    parser.add_argument('--downscale_factor', type=int, default=DEFAULT_DOWNSCALE_FACTOR,
+                        help=f'Factor to downscale the image for mesh generation (default: {DEFAULT_DOWNSCALE_FACTOR})')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of worker processes (default: number of CPU cores)')
+
+    args = parser.parse_args()
+
+    names = list_items() if args.all else args.names
+    if not names:
+        parser.error("Give at least one item name or --all")
+
+    _, errors = remesh_items(
+        names,
+        workers=args.workers,
+        scale=tuple(args.scale),
+        alpha_threshold=args.alpha_threshold,
+        downscale_factor=args.downscale_factor
+    )
+    if errors:
+        print(f"{len(errors)} of {len(names)} items failed.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
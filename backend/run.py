@@ -1,5 +1,6 @@
 import sys
 import os
+import argparse
 import numpy as np
 from PIL import Image
 
@@ -13,13 +14,18 @@ from fastsam import FastSAM, FastSAMPrompt
 
 
 
-# Ensure we have the right number of arguments
-if len(sys.argv) != 3:
-    print("Usage: python run.py <LOCAL_IMAGE_PATH> <TEXT_PROMPT>")
-    sys.exit(1)
+# Parse the arguments; the options let the upload pipeline pick a cheaper profile under load
+parser = argparse.ArgumentParser(description='Segment the garment in an image with FastSAM.')
+parser.add_argument('LOCAL_IMAGE_PATH', type=str, help='Path to the input image')
+parser.add_argument('TEXT_PROMPT', type=str, help='Text prompt describing the object to segment')
+parser.add_argument('--imgsz', type=int, default=None,
+                    help='Maximum inference size (default: the largest image dimension)')
+parser.add_argument('--no_retina', action='store_true',
+                    help='Skip high-resolution (retina) masks for faster inference')
+args = parser.parse_args()
 
-LOCAL_IMAGE_PATH = sys.argv[1]
-TEXT_PROMPT = sys.argv[2]
+LOCAL_IMAGE_PATH = args.LOCAL_IMAGE_PATH
+TEXT_PROMPT = args.TEXT_PROMPT
 
 # Check if the image exists
 if not os.path.isfile(LOCAL_IMAGE_PATH):
@@ -52,9 +58,11 @@ DEVICE = 'cpu'
 
 # Run the FastSAM model on the scaled image
 largestDim = max(image.size)
+if args.imgsz:
+    largestDim = min(largestDim, args.imgsz)
 largestDim = largestDim - (largestDim % 32)
 
-everything_results = model(scaled_image_path, device=DEVICE, retina_masks=True, imgsz=largestDim, conf=0.5, iou=0.5)
+everything_results = model(scaled_image_path, device=DEVICE, retina_masks=not args.no_retina, imgsz=largestDim, conf=0.5, iou=0.5)
 prompt_process = FastSAMPrompt(scaled_image_path, everything_results, device=DEVICE)
 
 # Process the prompt and generate the mask
@@ -75,6 +83,16 @@ mask = ann.astype(np.uint8) * 255  # Convert boolean mask to binary image
 # Print the unique values in the mask for debugging
 print(f"Unique values in the mask: {np.unique(mask)}")
 
+# Without retina masks FastSAM returns the mask at the letterboxed inference size, but
+# process.py needs it at the size of the scaled image: crop the padding and scale it back
+if mask.shape != (image.height, image.width):
+    mask_h, mask_w = mask.shape
+    gain = min(mask_h / image.height, mask_w / image.width)
+    pad_x = int(round((mask_w - image.width * gain) / 2 - 0.1))
+    pad_y = int(round((mask_h - image.height * gain) / 2 - 0.1))
+    mask = mask[pad_y:mask_h - pad_y, pad_x:mask_w - pad_x]
+    mask = np.array(Image.fromarray(mask).resize(image.size, Image.NEAREST))
+
 # Convert the mask to an image and save it with dynamic filename
 mask_image = Image.fromarray(mask)
 mask_image.save(mask_output_path)
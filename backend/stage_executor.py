@@ -0,0 +1,154 @@
+# stage_executor.py
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class StageError(Exception):
+    """
+    Raised through a job's future when one of the stages fails.
+    """
+    def __init__(self, stage, error):
+        super().__init__(f"{stage} failed: {error}")
+        self.stage = stage
+        self.error = error
+
+
+class Stage:
+    """
+    One pipeline stage: a worker pool pulling jobs from a bounded input queue.
+    """
+    def __init__(self, name, func, workers, queue_size):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.busy_seconds = 0.0
+        self.active = 0
+        self.processed = 0
+        self.failed = 0
+
+
+class StagePipeline:
+    """
+    Runs jobs through a list of stages, each with its own independently sized thread pool.
+    Stages are linked by bounded queues, so a slow stage only applies back-pressure to the
+    stage in front of it instead of idling the rest of the pipeline.
+
+    The stage functions in pipeline.py spend their time in subprocesses, so threads are enough
+    to keep several stages busy at once.
+    """
+    def __init__(self, stages, queue_size=4):
+        """
+        :param stages: List of (name, func, workers) tuples; func takes a job and returns it.
+        :param queue_size: Maximum number of jobs waiting in front of each stage.
+        """
+        self.stages = [Stage(name, func, workers, queue_size) for name, func, workers in stages]
+        self.lock = threading.Lock()
+        self.threads = []
+        self.started_at = None
+        self.submitted = 0
+        self.finished = 0
+
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            self.started_at = time.monotonic()
+            for index, stage in enumerate(self.stages):
+                for n in range(stage.workers):
+                    thread = threading.Thread(
+                        target=self._worker, args=(index,), name=f"{stage.name}-{n}", daemon=True
+                    )
+                    thread.start()
+                    self.threads.append(thread)
+
+    def submit(self, job):
+        """
+        Queues a job at the first stage, blocking while that stage's queue is full.
+
+        :return: Future that resolves to the job returned by the last stage.
+        """
+        self.start()
+        future = Future()
+        with self.lock:
+            self.submitted += 1
+        self.stages[0].queue.put((job, future))
+        return future
+
+    def pending(self):
+        """
+        Number of jobs submitted but not yet finished (queued or running).
+        """
+        with self.lock:
+            return self.submitted - self.finished
+
+    def _finish(self, future, result=None, error=None):
+        with self.lock:
+            self.finished += 1
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _worker(self, index):
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            job, future = stage.queue.get()
+            with stage.lock:
+                stage.active += 1
+            start = time.monotonic()
+            failed = None
+            try:
+                job = stage.func(job)
+            except Exception as e:
+                logger.error(f"Stage {stage.name} failed: {e}")
+                failed = StageError(stage.name, e)
+            finally:
+                with stage.lock:
+                    stage.active -= 1
+                    stage.busy_seconds += time.monotonic() - start
+                    if failed is None:
+                        stage.processed += 1
+                    else:
+                        stage.failed += 1
+                stage.queue.task_done()
+
+            if failed is not None:
+                self._finish(future, error=failed)
+            elif next_stage is not None:
+                next_stage.queue.put((job, future))
+            else:
+                self._finish(future, result=job)
+
+    def stats(self):
+        """
+        Per-stage statistics. Utilisation is the share of the stage's worker time spent running
+        jobs since the pipeline started.
+        """
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+        stages = []
+        for stage in self.stages:
+            with stage.lock:
+                capacity = elapsed * stage.workers
+                stages.append({
+                    "stage": stage.name,
+                    "workers": stage.workers,
+                    "active": stage.active,
+                    "queued": stage.queue.qsize(),
+                    "processed": stage.processed,
+                    "failed": stage.failed,
+                    "busy_seconds": round(stage.busy_seconds, 3),
+                    "utilisation": round(stage.busy_seconds / capacity, 4) if capacity else 0.0,
+                })
+        return {
+            "uptime_seconds": round(elapsed, 3),
+            "pending": self.pending(),
+            "stages": stages,
+        }
@@ -0,0 +1,166 @@
+# thumbnails.py
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from PIL import Image, features
+
+THUMBNAIL_FOLDER = './output/thumbnails'
+# Variants generated on demand (e.g. for items processed before thumbnails existed) live in
+# their own folder so they can be evicted without touching the pipeline's variants
+ON_DEMAND_FOLDER = os.path.join(THUMBNAIL_FOLDER, 'on_demand')
+
+# Fixed widths generated for every garment when it is processed
+THUMBNAIL_WIDTHS = (160, 320, 640)
+
+# Maximum number of on-demand variants kept on disk
+ON_DEMAND_CACHE_SIZE = int(os.getenv("THUMBNAIL_CACHE_SIZE", 500))
+
+# Formats in order of preference, with their MIME type and encoder options
+FORMATS = OrderedDict([
+    ("avif", {"mimetype": "image/avif", "save": {"quality": 60}}),
+    ("webp", {"mimetype": "image/webp", "save": {"quality": 80, "method": 4}}),
+])
+
+
+def available_formats():
+    """
+    Returns the thumbnail formats this Pillow build can encode.
+    """
+    return [fmt for fmt in FORMATS if features.check(fmt)]
+
+
+def nearest_width(size):
+    """
+    Picks the smallest fixed width that is at least the requested size, or the largest width
+    if the request is bigger than all of them.
+    """
+    for width in THUMBNAIL_WIDTHS:
+        if width >= size:
+            return width
+    return THUMBNAIL_WIDTHS[-1]
+
+
+def thumbnail_filename(name, width, fmt):
+    return f"{name}_{width}.{fmt}"
+
+
+def write_thumbnail(image, output_path, width, fmt):
+    """
+    Writes one resized variant of an RGBA image. Images narrower than the target width are not upscaled.
+    """
+    if image.width > width:
+        height = max(1, round(image.height * width / image.width))
+        image = image.resize((width, height), Image.LANCZOS)
+    # Unique temporary name, so concurrent writers of the same variant never clash
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(output_path) or ".",
+                                    prefix=os.path.basename(output_path) + ".", suffix=f".tmp.{fmt}")
+    os.close(fd)
+    try:
+        image.save(tmp_path, format=fmt.upper(), **FORMATS[fmt]["save"])
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def generate_thumbnails(cutout_path, name, widths=THUMBNAIL_WIDTHS):
+    """
+    Generates every fixed-width variant of a cutout in every available format.
+
+    :param cutout_path: Path to the '<name>_final.png' cutout.
+    :param name: Garment name the variants are stored under.
+    :return: List of generated file paths.
+    """
+    os.makedirs(THUMBNAIL_FOLDER, exist_ok=True)
+    paths = []
+    with Image.open(cutout_path) as image:
+        image = image.convert('RGBA')
+        for fmt in available_formats():
+            for width in widths:
+                path = os.path.join(THUMBNAIL_FOLDER, thumbnail_filename(name, width, fmt))
+                write_thumbnail(image, path, width, fmt)
+                paths.append(path)
+    return paths
+
+
+class OnDemandCache:
+    """
+    Bounded LRU of variants generated on request. When the cache is full the least recently
+    used file is deleted. The cache is seeded from the folder on startup, oldest first.
+    """
+    def __init__(self, folder, max_entries):
+        self.folder = folder
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        # filename -> lock held while that variant is being generated
+        self.creating = {}
+        if os.path.isdir(folder):
+            existing = [os.path.join(folder, f) for f in os.listdir(folder)]
+            for path in sorted(existing, key=os.path.getmtime):
+                self.entries[os.path.basename(path)] = path
+
+    def get_or_create(self, filename, create):
+        """
+        Returns the path of a cached variant, calling create(path) to generate it if needed.
+        Concurrent requests for the same missing variant generate it once.
+        """
+        with self.lock:
+            path = self.entries.get(filename)
+            if path and os.path.isfile(path):
+                self.entries.move_to_end(filename)
+                return path
+            creating = self.creating.setdefault(filename, threading.Lock())
+
+        with creating:
+            os.makedirs(self.folder, exist_ok=True)
+            path = os.path.join(self.folder, filename)
+            # Another thread (or process) may have generated it while we waited
+            if not os.path.isfile(path):
+                create(path)
+
+        with self.lock:
+            self.creating.pop(filename, None)
+            self.entries[filename] = path
+            self.entries.move_to_end(filename)
+            while len(self.entries) > self.max_entries:
+                _, evicted = self.entries.popitem(last=False)
+                try:
+                    os.remove(evicted)
+                except FileNotFoundError:
+                    pass
+        return path
+
+
+on_demand_cache = OnDemandCache(ON_DEMAND_FOLDER, ON_DEMAND_CACHE_SIZE)
+
+
+def get_thumbnail(cutout_path, name, size, accept):
+    """
+    Finds the variant of a cutout that best fits the requested size and Accept header,
+    generating it on demand if the pipeline has not produced it.
+
+    :param cutout_path: Path to the '<name>_final.png' cutout.
+    :param name: Garment name.
+    :param size: Requested width in pixels.
+    :param accept: The request's accepted MIME types (werkzeug MIMEAccept).
+    :return: Tuple of (path, mimetype), or None if the client accepts none of the formats.
+    """
+    # Highest quality value wins; ties go to the earlier (smaller) format
+    qualities = [(accept.quality(FORMATS[f]["mimetype"]), f) for f in available_formats()]
+    qualities = [(q, f) for q, f in qualities if q > 0]
+    if not qualities:
+        return None
+    fmt = max(qualities, key=lambda qf: qf[0])[1]
+    width = nearest_width(size)
+    filename = thumbnail_filename(name, width, fmt)
+
+    path = os.path.join(THUMBNAIL_FOLDER, filename)
+    if not os.path.isfile(path):
+        def create(output_path):
+            with Image.open(cutout_path) as image:
+                write_thumbnail(image.convert('RGBA'), output_path, width, fmt)
+        path = on_demand_cache.get_or_create(filename, create)
+    return path, FORMATS[fmt]["mimetype"]